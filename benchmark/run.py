@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import asyncpg
+import httpx
+
+from benchmark.seed import dsn
+
+SCENARIOS = ("news_list", "news_item", "comment_post", "news_patch")
+METRICS_HIGHER_IS_WORSE = ("p50", "p95", "p99")
+
+
+class Target:
+    """
+    Builds requests for the scenarios from the range of existing news ids
+    """
+
+    def __init__(self, min_id: int, max_id: int, rng: random.Random):
+        self.min_id = min_id
+        self.max_id = max_id
+        self.rng = rng
+
+    def news_id(self) -> int:
+        return self.rng.randint(self.min_id, self.max_id)
+
+    def request(self, scenario: str) -> tuple[str, str, dict]:
+        now = datetime.now(timezone.utc).isoformat()
+        if scenario == "news_list":
+            return "GET", "/news", {"params": {"limit": 50}}
+        if scenario == "news_item":
+            return "GET", f"/news/{self.news_id()}", {"params": {"limit": 50}}
+        if scenario == "comment_post":
+            return "POST", "/comments", {"json": {"news_id": self.news_id(), "title": "Benchmark",
+                                                  "date": now, "comment": "Benchmark comment"}}
+        if scenario == "news_patch":
+            return "PATCH", "/news", {"params": {"news_id": self.news_id()},
+                                      "json": {"title": "Benchmark", "date": now, "body": "Benchmark body"}}
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of the values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float, queries: int | None) -> dict:
+    requests = len(latencies) + errors
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50": round(percentile(latencies, 50) * 1000, 2),
+        "p95": round(percentile(latencies, 95) * 1000, 2),
+        "p99": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(queries / requests, 2) if queries is not None and requests else None,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    """
+    List the scenarios whose latency grew or throughput fell by more than the tolerance
+    """
+    regressions = []
+    for scenario, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(scenario)
+        if not before:
+            continue
+        for metric in METRICS_HIGHER_IS_WORSE:
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{scenario}: {metric} {before[metric]}ms -> {result[metric]}ms")
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: rps {before['rps']} -> {result['rps']}")
+    return regressions
+
+
+class StatementCounter:
+    """
+    Counts statements executed by the database through pg_stat_statements, when the extension is installed
+    """
+
+    def __init__(self, connection: asyncpg.Connection | None):
+        self.connection = connection
+
+    @classmethod
+    async def connect(cls):
+        connection = await asyncpg.connect(dsn())
+        try:
+            await connection.execute("SELECT pg_stat_statements_reset()")
+        except asyncpg.PostgresError:
+            await connection.close()
+            print("pg_stat_statements is not available, query counts are skipped")
+            return cls(None)
+        return cls(connection)
+
+    async def reset(self):
+        if self.connection:
+            await self.connection.execute("SELECT pg_stat_statements_reset()")
+
+    async def total(self) -> int | None:
+        if not self.connection:
+            return None
+        return await self.connection.fetchval(
+            "SELECT coalesce(sum(calls), 0) FROM pg_stat_statements "
+            "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+            "AND query NOT ILIKE '%pg_stat_statements%'")
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+
+
+async def run_scenario(client: httpx.AsyncClient, target: Target, scenario: str,
+                       concurrency: int, duration: float, counter: StatementCounter) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, url, kwargs = target.request(scenario)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    await counter.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed, await counter.total())
+
+
+def start_server(server: str, workers: int, port: int) -> subprocess.Popen:
+    if server == "gunicorn":
+        command = ["gunicorn", "main:app", "--workers", str(workers),
+                   "--worker-class", "uvicorn.workers.UvicornWorker", f"--bind=127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+                   "--log-level", "warning"]
+    return subprocess.Popen(command)
+
+
+async def wait_for_server(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("The server did not start in time")
+
+
+async def benchmark(args) -> dict:
+    connection = await asyncpg.connect(dsn())
+    try:
+        min_id, max_id = await connection.fetchrow('SELECT min(id), max(id) FROM "News" WHERE NOT is_deleted')
+    finally:
+        await connection.close()
+    if min_id is None:
+        raise RuntimeError("The database is empty, run python -m benchmark.seed first")
+    target = Target(min_id, max_id, random.Random(args.seed))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    counter = await StatementCounter.connect()
+    try:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+            await wait_for_server(client)
+            results = {}
+            for scenario in args.scenarios:
+                await run_scenario(client, target, scenario, args.concurrency, args.warmup, StatementCounter(None))
+                results[scenario] = await run_scenario(client, target, scenario, args.concurrency, args.duration,
+                                                       counter)
+                print(f"{scenario}: {json.dumps(results[scenario])}")
+    finally:
+        await counter.close()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "server": args.server,
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the news API against the database configured in .env")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of unmeasured load per scenario")
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn", "none"), default="gunicorn",
+                        help="'none' benchmarks an already running server at --url")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="defaults to the started server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="baseline file to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+    args.url = args.url or f"http://127.0.0.1:{args.port}"
+
+    process = start_server(args.server, args.workers, args.port) if args.server != "none" else None
+    try:
+        report = asyncio.run(benchmark(args))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), report, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+from sqlalchemy import make_url
+
+from config import get_settings
+from database import database_url
+
+START_DATE = datetime(2020, 1, 1, tzinfo=timezone.utc)
+BATCH_SIZE = 50_000
+
+
+def dsn() -> str:
+    """
+    The app's database URL without the +asyncpg driver suffix, as asyncpg.connect takes it
+    """
+    url = make_url(database_url(get_settings()))
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def batches(records, size: int = BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def news_records(count: int, rng: random.Random):
+    for number in range(count):
+        date = START_DATE + timedelta(minutes=number * 5)
+        yield f"News {number}", date, f"Body of news {number} " * rng.randint(5, 50), False, 0, 1
+
+
+def comment_records(count: int, news_count: int, rng: random.Random):
+    for number in range(count):
+        date = START_DATE + timedelta(seconds=number)
+        yield rng.randint(1, news_count), f"Comment {number}", date, f"Comment text {number}"
+
+
+async def seed(news: int, comments: int, random_seed: int = 0):
+    """
+    Fill a migrated database with synthetic news and comments; existing rows are truncated
+    """
+    rng = random.Random(random_seed)
+    connection = await asyncpg.connect(dsn())
+    try:
+        await connection.execute('TRUNCATE "News", comments RESTART IDENTITY CASCADE')
+        for batch in batches(news_records(news, rng)):
+            await connection.copy_records_to_table(
+                "News", records=batch,
+                columns=["title", "date", "body", "is_deleted", "comments_count", "version"])
+        for number, batch in enumerate(batches(comment_records(comments, news, rng))):
+            await connection.copy_records_to_table(
+                "comments", records=batch, columns=["news_id", "title", "date", "comment"])
+            print(f"comments: {min((number + 1) * BATCH_SIZE, comments)}/{comments}")
+        await connection.execute(
+            'UPDATE "News" SET comments_count = counts.total '
+            'FROM (SELECT news_id, count(*) AS total FROM comments GROUP BY news_id) AS counts '
+            'WHERE "News".id = counts.news_id')
+        await connection.execute('ANALYZE "News"')
+        await connection.execute('ANALYZE comments')
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database configured in .env with synthetic data")
+    parser.add_argument("--news", type=int, default=100_000)
+    parser.add_argument("--comments", type=int, default=5_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(seed(args.news, args.comments, args.seed))
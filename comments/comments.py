@@ -2,24 +2,24 @@ from typing import Annotated
 
 from fastapi import APIRouter, HTTPException, Depends
 
-from comments.repository import CommentsRepository
 from comments.schemas import BaseCommentModel
+from database import UnitOfWorkRoute
 from news.repository import NewsRepository
+from utils.cache import CacheBackend, get_cache, news_keys
 
-comments_router = APIRouter(prefix="/comments", tags=["comments"])
+comments_router = APIRouter(prefix="/comments", tags=["comments"], route_class=UnitOfWorkRoute)
 
 
 @comments_router.post("",
                       response_model=BaseCommentModel,
                       name="comment post")
 async def add_comment(comment: BaseCommentModel,
-                      comments_repo: Annotated[CommentsRepository, Depends(CommentsRepository)],
-                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)]) -> BaseCommentModel:
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                      cache: Annotated[CacheBackend, Depends(get_cache)]) -> BaseCommentModel:
     """
     Add a comment on the news
     """
-    comment_dict = comment.model_dump()
-    if not await news_repo.find_one(comment_dict["news_id"]):
+    if not await news_repo.add_comment(comment.model_dump()):
         raise HTTPException(status_code=404, detail="News with this ID does not exist")
-    await comments_repo.add_one(comment_dict)
+    await cache.invalidate(*news_keys(comment.news_id))
     return comment
@@ -1,26 +1,34 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, select, func
-from sqlalchemy.orm import mapped_column
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Index, select, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, mapped_column
 
-from database import Base, async_session_maker
+from database import Base
 from utils.repository import SQLAlchemyRepository
+from utils.search import weighted_tsvector
 
 
 class Comments(Base):
     __tablename__ = 'comments'
-    __table_args__ = {'extend_existing': True}
 
     id = Column(Integer, primary_key=True)
     news_id = mapped_column(ForeignKey('News.id'), nullable=False)
     title = Column(String, nullable=False)
     date = Column(DateTime(timezone=True), nullable=False)
     comment = Column(String, nullable=False)
+    # deferred so that ordinary loads never fetch it
+    search_vector = deferred(Column(TSVECTOR, weighted_tsvector(("title", "A"), ("comment", "B"))))
+
+    __table_args__ = (
+        Index('ix_comments_news_id_date_id', news_id, date, id),
+        Index('ix_comments_search_vector', 'search_vector', postgresql_using='gin'),
+        {'extend_existing': True},
+    )
 
 
 class CommentsRepository(SQLAlchemyRepository):
     model = Comments
 
-    async def comments_count(self, news_id: id):
-        async with async_session_maker() as session:
-            query = select(func.count()).select_from(self.model).where(self.model.news_id == news_id)
-            result = await session.execute(query)
-            return result.scalar()
+    async def comments_count(self, news_id: int):
+        query = select(func.count()).select_from(self.model).where(self.model.news_id == news_id)
+        result = await self.session.execute(query)
+        return result.scalar()
@@ -13,3 +13,8 @@ class BaseCommentModel(BaseModel):
 class GetCommentModel(BaseCommentModel):
     id: int
 
+
+class BulkCommentModel(BaseModel):
+    title: str
+    date: datetime
+    comment: str
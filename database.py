@@ -1,18 +1,240 @@
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Annotated, Awaitable, Callable
+
+from fastapi import Depends, Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import URL, exc
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import Settings, get_settings
+from utils.instrumentation import record_pool_wait
 
-from config import settings
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
-engine = create_async_engine(f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASS}@{settings.DB_HOST}:"
-                             f"{settings.DB_PORT}/{settings.DB_NAME}")
-async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how many checkouts there were and how long they waited for a free connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
 
-async def get_async_session():
-    async with async_session_maker() as session:
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
         try:
-            yield session
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            timed_out = True
+            raise
         finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            record_pool_wait(waited, timed_out)
+
+
+def database_url(settings: Settings) -> str:
+    url = URL.create("postgresql+asyncpg", username=settings.DB_USER, password=settings.DB_PASS,
+                     host=settings.DB_HOST, port=int(settings.DB_PORT), database=settings.DB_NAME)
+    return url.render_as_string(hide_password=False)
+
+
+def make_engine(url: str, settings: Settings) -> AsyncEngine:
+    server_settings = {}
+    if settings.DB_STATEMENT_TIMEOUT:
+        server_settings["statement_timeout"] = str(settings.DB_STATEMENT_TIMEOUT)
+    return create_async_engine(url,
+                               poolclass=MeteredPool,
+                               pool_size=settings.DB_POOL_SIZE,
+                               max_overflow=settings.DB_MAX_OVERFLOW,
+                               pool_timeout=settings.DB_POOL_TIMEOUT,
+                               pool_recycle=settings.DB_POOL_RECYCLE,
+                               pool_pre_ping=settings.DB_POOL_PRE_PING,
+                               connect_args={
+                                   "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+                                   "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+                                   "server_settings": server_settings,
+                               })
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "checkouts": pool.checkouts,
+        "timeouts": pool.timeouts,
+        "wait_time": pool.wait_time,
+        "max_wait_time": pool.max_wait_time,
+    }
+
+
+class ReplicaHealth:
+    """
+    Keeps reads off a replica for a while after it failed to connect
+    """
+
+    def __init__(self, retry_seconds: float):
+        self.retry_seconds = retry_seconds
+        self.down_until = 0.0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + self.retry_seconds
+
+
+def read_only(engine: AsyncEngine) -> AsyncEngine:
+    """
+    The engine with transactions opened as BEGIN READ ONLY, which asyncpg sends with the first query
+    """
+    return engine.execution_options(postgresql_readonly=True)
+
+
+PRIMARY_COOKIE = "db_primary"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Database:
+    """
+    Engines and session makers of one worker process, created by the app lifespan and disposed when it ends
+    """
+
+    def __init__(self, engine: AsyncEngine, replica_engine: AsyncEngine | None = None,
+                 replica_retry_seconds: float = 30.0, replica_sticky_seconds: int = 5):
+        self.engine = engine
+        self.session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        self.read_session_maker = async_sessionmaker(read_only(engine), expire_on_commit=False)
+        self.replica_engine = replica_engine
+        self.replica_session_maker = async_sessionmaker(read_only(replica_engine), expire_on_commit=False) \
+            if replica_engine else None
+        self.replica_health = ReplicaHealth(replica_retry_seconds)
+        self.replica_sticky_seconds = replica_sticky_seconds
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "Database":
+        replica_engine = make_engine(settings.DB_REPLICA_URL, settings) if settings.DB_REPLICA_URL else None
+        return cls(make_engine(database_url(settings), settings), replica_engine,
+                   settings.DB_REPLICA_RETRY_SECONDS, settings.DB_REPLICA_STICKY_SECONDS)
+
+    def engines(self) -> dict[str, AsyncEngine]:
+        engines = {"primary": self.engine}
+        if self.replica_engine:
+            engines["replica"] = self.replica_engine
+        return engines
+
+    async def warm_up(self, connections: int, queries: Callable[[AsyncSession], Awaitable] | None = None):
+        """
+        Open connections in every pool before the first request and run the hot queries on each of them,
+        so that the statements are compiled and prepared; a database that is down only logs a warning
+        """
+        session_makers = {"primary": self.read_session_maker, "replica": self.replica_session_maker}
+        for name, session_maker in session_makers.items():
+            if session_maker is None or connections < 1:
+                continue
+            try:
+                async with AsyncExitStack() as stack:
+                    # all sessions stay open until the end, so every one checks out a connection of its own
+                    sessions = [await stack.enter_async_context(session_maker()) for _ in range(connections)]
+                    await asyncio.gather(*(session.connection() for session in sessions))
+                    if queries:
+                        await asyncio.gather(*(queries(session) for session in sessions))
+            except (exc.DBAPIError, OSError) as e:
+                logger.warning("Warm-up of the %s pool failed: %s", name, e)
+
+    async def dispose(self):
+        for engine in self.engines().values():
+            await engine.dispose()
+
+
+@asynccontextmanager
+async def open_database(settings: Settings | None = None):
+    """
+    Database for scripts run outside the app
+    """
+    database = Database.from_settings(settings or get_settings())
+    try:
+        yield database
+    finally:
+        await database.dispose()
+
+
+def get_database(request: Request) -> Database:
+    return request.app.state.database
+
+
+async def get_async_session(request: Request, database: Annotated[Database, Depends(get_database)]):
+    """
+    Session of one request, its unit of work. Reads run in a READ ONLY transaction that is never committed.
+    Writes are committed once after the route returned and rolled back on any error
+    """
+    if request.method in READ_METHODS:
+        async with database.read_session_maker() as session:
+            yield session
+        return
+    async with database.session_maker() as session:
+        request.state.write_session = session
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        # UnitOfWorkRoute may have committed already
+        if session.in_transaction():
             await session.commit()
+
+
+class UnitOfWorkRoute(APIRoute):
+    """
+    Route that commits the write session of the request before the response is sent, so a failed commit
+    becomes an error response rather than a lost write behind a success status
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def unit_of_work_handler(request: Request) -> Response:
+            response = await handler(request)
+            session = getattr(request.state, "write_session", None)
+            if session is not None and session.in_transaction():
+                await session.commit()
+            return response
+
+        return unit_of_work_handler
+
+
+async def get_read_session(request: Request, database: Annotated[Database, Depends(get_database)]):
+    """
+    READ ONLY session for read-only routes: the replica when configured and reachable, otherwise the primary.
+    Clients carrying the cookie set after their own writes keep reading from the primary
+    """
+    replica_health = database.replica_health
+    if database.replica_session_maker and replica_health.available() and PRIMARY_COOKIE not in request.cookies:
+        async with database.replica_session_maker() as session:
+            try:
+                await session.connection()
+            except (exc.DBAPIError, OSError):
+                replica_health.mark_down()
+            else:
+                yield session
+                return
+    async with database.read_session_maker() as session:
+        yield session
@@ -2,4 +2,9 @@
 
 alembic upgrade head
 
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
\ No newline at end of file
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+export DB_WARMUP_CONNECTIONS="${DB_WARMUP_CONNECTIONS:-2}"
+
+gunicorn main:app --workers "${WEB_WORKERS:-4}" --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
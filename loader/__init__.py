@@ -0,0 +1,2 @@
+from . import data_loader
+from . import schemas
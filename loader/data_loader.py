@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import codecs
+import json
+from typing import Annotated, AsyncIterator, Iterable
+
+from fastapi import APIRouter, Depends, Query, Request
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from comments.repository import CommentsRepository
+from database import get_async_session, open_database
+from loader.schemas import BulkLoadErrorModel, BulkLoadReportModel, BulkNewsModel
+from news.repository import NewsRepository
+from utils.cache import CacheBackend, get_cache, news_keys
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+CHUNK_SIZE = 64 * 1024
+
+loader_router = APIRouter(prefix="/news", tags=["news"])
+
+
+class MalformedRecord:
+    """
+    A record of the stream that is not valid JSON, in place of the record it should have been
+    """
+
+    def __init__(self, detail: str):
+        self.detail = detail
+
+
+class RecordDecoder:
+    """
+    Incrementally split a JSON array or a JSON Lines stream into top-level records; a malformed record is
+    reported as a MalformedRecord and decoding resumes after it, only a record cut off by the end of the
+    chunk is kept for the next one
+    """
+    SEPARATORS = " \t\r\n,[]"
+
+    def __init__(self):
+        self._buffer = ""
+        self._lines = None
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+
+    def feed(self, chunk: bytes | str) -> list:
+        if isinstance(chunk, bytes):
+            chunk = self._text.decode(chunk)
+        self._buffer += chunk
+        if self._lines is None and self._buffer.strip():
+            self._lines = not self._buffer.lstrip().startswith("[")
+        records = []
+        position = 0
+        while True:
+            while position < len(self._buffer) and self._buffer[position] in self.SEPARATORS:
+                position += 1
+            if position >= len(self._buffer):
+                break
+            try:
+                record, position = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError as e:
+                end = self.record_end(position, e)
+                if end is None:
+                    # the record continues in the next chunk
+                    break
+                records.append(MalformedRecord(f"Malformed JSON record: {e.msg}: "
+                                               f"{self._buffer[position:end].strip()[:200]!r}"))
+                position = end
+                continue
+            records.append(record)
+        self._buffer = self._buffer[position:]
+        return records
+
+    def record_end(self, start: int, error: json.JSONDecodeError) -> int | None:
+        """
+        Position after the malformed record starting at start: the next line in JSON Lines, the end of the
+        top-level element in an array; None when the error is the end of the buffer rather than a malformed record
+        """
+        if self._lines:
+            newline = self._buffer.find("\n", error.pos)
+            return None if newline == -1 else newline + 1
+        return self.element_end(start)
+
+    def element_end(self, start: int) -> int | None:
+        """
+        Position after the array element starting at start, found by its brackets outside strings, so that a
+        pretty-printed broken object is skipped as a whole; None when the element is not closed in the buffer
+        """
+        depth = 0
+        in_string = escaped = False
+        for index in range(start, len(self._buffer)):
+            char = self._buffer[index]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char in '"\n':
+                    # a raw newline cannot be inside a JSON string, the string was left open
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if depth <= 0:
+                    # a bracket closing the array itself is left for the separators
+                    return index + 1 if depth == 0 else index
+            elif depth == 0 and char in ",\n":
+                return index
+        return None
+
+    def close(self):
+        self._buffer += self._text.decode(b"", final=True)
+        if self._buffer.strip(self.SEPARATORS):
+            raise ValueError(f"Malformed or truncated JSON record: {self._buffer[:200]!r}")
+
+
+async def iter_chunk_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    decoder = RecordDecoder()
+    async for chunk in chunks:
+        for record in decoder.feed(chunk):
+            yield record
+    decoder.close()
+
+
+async def iter_file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+class NewsLoader:
+    """
+    Validate news records (with nested comments) and insert them batch by batch, one commit per batch
+    """
+
+    def __init__(self, session: AsyncSession, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.session = session
+        self.news_repo = NewsRepository(session)
+        self.comments_repo = CommentsRepository(session)
+        self.batch_size = batch_size
+        self.report = BulkLoadReportModel()
+
+    def add_error(self, record: int | None, detail: str):
+        self.report.error_count += 1
+        if len(self.report.errors) < MAX_REPORTED_ERRORS:
+            self.report.errors.append(BulkLoadErrorModel(batch=self.report.batches, record=record, detail=detail))
+
+    async def load(self, records: AsyncIterator[dict]) -> BulkLoadReportModel:
+        batch = []
+        index = 0
+        try:
+            async for record in records:
+                if isinstance(record, MalformedRecord):
+                    self.add_error(index, record.detail)
+                else:
+                    try:
+                        batch.append(BulkNewsModel.model_validate(record))
+                    except ValidationError as e:
+                        self.add_error(index, str(e))
+                index += 1
+                if len(batch) >= self.batch_size:
+                    await self.flush(batch)
+                    batch = []
+        except ValueError as e:
+            self.add_error(index, str(e))
+        if batch:
+            await self.flush(batch)
+        return self.report
+
+    async def flush(self, batch: list[BulkNewsModel]):
+        try:
+            news_rows = [{**news.model_dump(exclude={"comments"}), "comments_count": len(news.comments)}
+                         for news in batch]
+            news_ids = await self.news_repo.add_many(news_rows, commit=False)
+            comment_rows = [{**comment.model_dump(), "news_id": news_id}
+                            for news_id, news in zip(news_ids, batch)
+                            for comment in news.comments]
+            await self.comments_repo.add_many(comment_rows, commit=False)
+            await self.session.commit()
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            self.add_error(None, f"Batch rolled back: {e}")
+        else:
+            self.report.inserted_news += len(news_rows)
+            self.report.inserted_comments += len(comment_rows)
+        self.report.batches += 1
+
+
+@loader_router.post("/bulk",
+                    response_model=BulkLoadReportModel,
+                    name="news_bulk")
+async def bulk_load_news(request: Request,
+                         session: Annotated[AsyncSession, Depends(get_async_session)],
+                         cache: Annotated[CacheBackend, Depends(get_cache)],
+                         batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=10000)
+                         ) -> BulkLoadReportModel:
+    """
+    Load news with their comments from a JSON array or JSON Lines request body
+    """
+    report = await NewsLoader(session, batch_size).load(iter_chunk_records(request.stream()))
+    if report.inserted_news:
+        await cache.invalidate(*news_keys())
+    return report
+
+
+async def load_files(paths: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE):
+    async with open_database() as database, database.session_maker() as session:
+        for path in paths:
+            report = await NewsLoader(session, batch_size).load(iter_chunk_records(iter_file_chunks(path)))
+            print(f"{path}: {report.model_dump_json(indent=2)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load news with their comments from JSON or JSON Lines files")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(load_files(args.paths, args.batch_size))
@@ -0,0 +1,24 @@
+from typing import List
+
+from pydantic import BaseModel
+
+from comments.schemas import BulkCommentModel
+from news.schemas import BaseNewsModel
+
+
+class BulkNewsModel(BaseNewsModel):
+    comments: List[BulkCommentModel] = []
+
+
+class BulkLoadErrorModel(BaseModel):
+    batch: int
+    record: int | None = None
+    detail: str
+
+
+class BulkLoadReportModel(BaseModel):
+    inserted_news: int = 0
+    inserted_comments: int = 0
+    batches: int = 0
+    error_count: int = 0
+    errors: List[BulkLoadErrorModel] = []
@@ -1,9 +1,80 @@
-from fastapi import FastAPI
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Annotated
+
+from fastapi import Depends, FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
 
 from comments.comments import comments_router
+from config import get_settings
+from database import PRIMARY_COOKIE, READ_METHODS, Database, get_database, open_database, pool_stats
+from loader.data_loader import loader_router
+from news.events import NewsEvents, listen_dsn
 from news.news import news_router
+from news.repository import NewsRepository
+from utils.admission import AdmissionControl, AdmissionMiddleware
+from utils.cache import get_cache
+from utils.instrumentation import InstrumentationMiddleware, install_query_listeners
+from utils.log import setup_logging
+from utils.metrics import render_metrics, update_pool_metrics, watch_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the database engines and the news events listener when the worker starts, warm the pools up and
+    dispose them on shutdown.
+    A Database already put into app.state, e.g. by tests, is only instrumented and stays with its owner
+    """
+    injected = getattr(app.state, "database", None)
+    async with AsyncExitStack() as stack:
+        settings = None
+        database = injected
+        if database is None:
+            settings = get_settings()
+            setup_logging(settings)
+            database = await stack.enter_async_context(open_database(settings))
+        for name, engine in database.engines().items():
+            install_query_listeners(engine, settings.SLOW_QUERY_MS if settings else 0.0)
+            watch_pool(name, engine)
+        if settings:
+            await database.warm_up(settings.DB_WARMUP_CONNECTIONS,
+                                   lambda session: NewsRepository(session).warm_up())
+        app.state.database = database
+        if settings and settings.ADMISSION_LIMIT != 0:
+            app.state.admission = AdmissionControl.from_settings(settings)
+        news_events = NewsEvents(listen_dsn(database.engine))
+        if settings:
+            news_events.queue_size = settings.EVENTS_QUEUE_SIZE
+            news_events.heartbeat_seconds = settings.EVENTS_HEARTBEAT_SECONDS
+        stack.push_async_callback(news_events.close)
+        app.state.news_events = news_events
+        try:
+            yield
+        finally:
+            del app.state.news_events
+            if not injected:
+                del app.state.database
+                if hasattr(app.state, "admission"):
+                    del app.state.admission
+
 
-app = FastAPI(title="UDV Assigment Test ValiullinAO")
+app = FastAPI(title="UDV Assigment Test ValiullinAO", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# inside InstrumentationMiddleware, so the requests it sheds are counted and logged too
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(InstrumentationMiddleware)
+
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """
+    Pin a client's reads to the primary for a few seconds after it wrote, so replica lag cannot hide the write
+    """
+    response = await call_next(request)
+    database = getattr(request.app.state, "database", None)
+    if database and database.replica_engine and request.method not in READ_METHODS and response.status_code < 400:
+        response.set_cookie(PRIMARY_COOKIE, "1", max_age=database.replica_sticky_seconds, httponly=True)
+    return response
 
 
 @app.get("/")
@@ -11,5 +82,29 @@ async def foo():
     return {"message": "bar"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    update_pool_metrics()
+    content, content_type = render_metrics()
+    return Response(content, media_type=content_type)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return get_cache().stats()
+
+
+@app.get("/admission/stats")
+async def admission_stats(request: Request):
+    admission = getattr(request.app.state, "admission", None)
+    return admission.stats() if admission else {}
+
+
+@app.get("/db/pool/stats")
+async def db_pool_stats(database: Annotated[Database, Depends(get_database)]):
+    return {name: pool_stats(engine) for name, engine in database.engines().items()}
+
+
+app.include_router(loader_router, tags=["news"])
 app.include_router(news_router, tags=["news"])
 app.include_router(comments_router, tags=["comments"])
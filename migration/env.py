@@ -5,7 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from config import settings
+from config import get_settings
 from news.repository import News
 from comments.repository import Comments
 
@@ -13,6 +13,7 @@ from comments.repository import Comments
 # access to the values within the .ini file in use.
 config = context.config
 
+settings = get_settings()
 section = config.config_ini_section
 config.set_section_option(section, "DB_HOST", settings.DB_HOST)
 config.set_section_option(section, "DB_PORT", settings.DB_PORT)
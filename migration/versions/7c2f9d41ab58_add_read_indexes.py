@@ -0,0 +1,36 @@
+"""add read indexes
+
+Revision ID: 7c2f9d41ab58
+Revises: 3510cbc92a09
+Create Date: 2026-10-18 10:12:37.514203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2f9d41ab58'
+down_revision: Union[str, None] = '3510cbc92a09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_comments_news_id_date_id', 'comments', ['news_id', 'date', 'id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_News_date_id_not_deleted', 'News', [sa.text('date DESC'), sa.text('id DESC')],
+                        unique=False, postgresql_where=sa.text('NOT is_deleted'),
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_News_date_id_not_deleted', table_name='News',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_comments_news_id_date_id', table_name='comments',
+                      postgresql_concurrently=True, if_exists=True)
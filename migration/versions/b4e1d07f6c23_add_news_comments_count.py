@@ -0,0 +1,31 @@
+"""add news comments_count
+
+Revision ID: b4e1d07f6c23
+Revises: 7c2f9d41ab58
+Create Date: 2026-10-18 11:03:51.208817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e1d07f6c23'
+down_revision: Union[str, None] = '7c2f9d41ab58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('News', sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE "News" SET comments_count = counts.total '
+        'FROM (SELECT news_id, count(*) AS total FROM comments GROUP BY news_id) AS counts '
+        'WHERE "News".id = counts.news_id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('News', 'comments_count')
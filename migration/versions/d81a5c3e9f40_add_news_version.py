@@ -0,0 +1,26 @@
+"""add news version
+
+Revision ID: d81a5c3e9f40
+Revises: b4e1d07f6c23
+Create Date: 2026-10-18 12:26:09.731554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81a5c3e9f40'
+down_revision: Union[str, None] = 'b4e1d07f6c23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('News', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('News', 'version')
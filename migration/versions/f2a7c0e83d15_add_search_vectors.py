@@ -0,0 +1,47 @@
+"""add search vectors
+
+Revision ID: f2a7c0e83d15
+Revises: d81a5c3e9f40
+Create Date: 2026-10-18 14:41:22.905117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c0e83d15'
+down_revision: Union[str, None] = 'd81a5c3e9f40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NEWS_SEARCH_VECTOR = ("setweight(to_tsvector('simple', title), 'A') || "
+                      "setweight(to_tsvector('simple', body), 'B')")
+COMMENTS_SEARCH_VECTOR = ("setweight(to_tsvector('simple', title), 'A') || "
+                          "setweight(to_tsvector('simple', comment), 'B')")
+
+
+def upgrade() -> None:
+    op.add_column('News', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                    sa.Computed(NEWS_SEARCH_VECTOR, persisted=True), nullable=True))
+    op.add_column('comments', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                        sa.Computed(COMMENTS_SEARCH_VECTOR, persisted=True), nullable=True))
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_News_search_vector', 'News', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_comments_search_vector', 'comments', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_comments_search_vector', table_name='comments',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_News_search_vector', table_name='News',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('comments', 'search_vector')
+    op.drop_column('News', 'search_vector')
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+import asyncpg
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+NEWS_EVENTS_CHANNEL = "news_events"
+# sent to a subscriber that missed events, it should refetch the news item
+RESYNC_EVENT = {"event": "resync"}
+RECONNECT_SECONDS = 1.0
+MAX_RECONNECT_SECONDS = 30.0
+SSE_HEARTBEAT = b": heartbeat\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Events of one news item for one client, in a bounded queue; a client that falls behind loses the queued
+    events and gets a resync event instead, so a slow reader never holds memory or the listener back
+    """
+
+    def __init__(self, hub: "NewsEvents", news_id: int, queue_size: int):
+        self.hub = hub
+        self.news_id = news_id
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self, timeout: float) -> dict | None:
+        """
+        Next event, or None when there was none for timeout seconds
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class NewsEvents:
+    """
+    One LISTEN connection per worker, opened with the first subscriber, that fans the NOTIFY payloads out to
+    the subscribers of each news item and reconnects when the connection is lost
+    """
+
+    def __init__(self, dsn: str, queue_size: int = 100, heartbeat_seconds: float = 15.0):
+        self.dsn = dsn
+        self.queue_size = queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self.subscribers: dict[int, set[Subscription]] = defaultdict(set)
+        self.connection: asyncpg.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._reconnect: asyncio.Task | None = None
+        self._closed = False
+
+    async def subscribe(self, news_id: int) -> Subscription:
+        await self.listen()
+        subscription = Subscription(self, news_id, self.queue_size)
+        self.subscribers[news_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscribers.get(subscription.news_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.news_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    async def listen(self):
+        async with self._lock:
+            if self.connection is not None and not self.connection.is_closed():
+                return
+            connection = await asyncpg.connect(self.dsn)
+            connection.add_termination_listener(self._on_terminate)
+            await connection.add_listener(NEWS_EVENTS_CHANNEL, self._on_notify)
+            self.connection = connection
+
+    def dispatch(self, event: dict):
+        for subscription in tuple(self.subscribers.get(event.get("news_id"), ())):
+            subscription.push(event)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning("Malformed %s payload: %r", channel, payload)
+            return
+        self.dispatch(event)
+
+    def _on_terminate(self, connection):
+        if self._closed or connection is not self.connection:
+            return
+        self.connection = None
+        self._reconnect = asyncio.get_running_loop().create_task(self._keep_listening())
+
+    async def _keep_listening(self):
+        delay = RECONNECT_SECONDS
+        while not self._closed and self.subscribers:
+            try:
+                await self.listen()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("LISTEN %s reconnect failed: %s", NEWS_EVENTS_CHANNEL, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_SECONDS)
+            else:
+                # whatever was notified while disconnected is lost
+                for subscribers in tuple(self.subscribers.values()):
+                    for subscription in tuple(subscribers):
+                        subscription.push(RESYNC_EVENT)
+                return
+
+    async def close(self):
+        self._closed = True
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+
+def listen_dsn(engine: AsyncEngine) -> str:
+    """
+    asyncpg DSN of the engine's database; notifications are not replicated, so this must be the primary
+    """
+    return engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def get_news_events(request: Request) -> NewsEvents:
+    return request.app.state.news_events
+
+
+def sse_message(event: dict) -> bytes:
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode()
+
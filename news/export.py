@@ -0,0 +1,44 @@
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator
+
+from comments.schemas import GetCommentModel
+
+EXPORT_NEWS_FIELDS = ("id", "title", "date", "body", "comments_count")
+EXPORT_COMMENT_COLUMNS = {"id": "comment_id", "title": "comment_title", "date": "comment_date", "comment": "comment"}
+CSV_HEADER = (*EXPORT_NEWS_FIELDS, *EXPORT_COMMENT_COLUMNS.values())
+
+
+def comment_document(row) -> dict:
+    return {field: row.id if field == "news_id" else getattr(row, EXPORT_COMMENT_COLUMNS[field])
+            for field in GetCommentModel.model_fields}
+
+
+async def news_documents(rows: AsyncIterable) -> AsyncIterator[dict]:
+    """
+    Fold the joined rows of NewsRepository.stream_with_comments into one document per news item with its comments
+    """
+    news = None
+    async for row in rows:
+        if news is None or news["id"] != row.id:
+            if news is not None:
+                yield news
+            news = {field: getattr(row, field) for field in EXPORT_NEWS_FIELDS}
+            news["comments"] = []
+        if row.comment_id is not None:
+            news["comments"].append(comment_document(row))
+    if news is not None:
+        yield news
+
+
+def csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def csv_rows(rows: AsyncIterable) -> AsyncIterator[tuple]:
+    """
+    One CSV row per news comment pair, in CSV_HEADER order
+    """
+    async for row in rows:
+        yield tuple(csv_value(getattr(row, column)) for column in CSV_HEADER)
@@ -1,25 +1,44 @@
-from typing import Dict, Any, Sequence, Annotated
+import logging
+from datetime import datetime
+from typing import Dict, Any, Sequence, Annotated, List, Literal
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
 from comments.repository import CommentsRepository
-from news.repository import NewsRepository
-from news.schemas import BaseNewsModel, GetNewsModel, GetNewsCommentsModel, GetNewsListModel
+from comments.schemas import GetCommentModel
+from database import UnitOfWorkRoute
+from news.events import SSE_HEARTBEAT, NewsEvents, get_news_events, sse_message
+from news.export import CSV_HEADER, csv_rows, news_documents
+from news.repository import COMMENT_FIELDS, NEWS_FIELDS, NewsRepository
+from news.schemas import BaseNewsModel, GetNewsModel, GetNewsCommentsModel, GetNewsListModel, NewsIdsModel, \
+    NewsSearchModel, NewsStatusChangeModel
+from utils.cache import CacheBackend, get_cache, news_item_key, news_keys, news_list_key
+from utils.etag import etag_matches, make_etag
+from utils.pagination import Pagination, RankPagination
+from utils.responses import JSONBytesResponse, accepts_gzip, csv_chunks, dump_json, ndjson_chunks, row_dict, \
+    streaming_export, streaming_json_array
 
-news_router = APIRouter(prefix="/news", tags=['news'])
+logger = logging.getLogger(__name__)
+
+STREAM_BATCH_SIZE = 1000
+
+news_router = APIRouter(prefix="/news", tags=['news'], route_class=UnitOfWorkRoute)
 
 
 @news_router.post("",
                   response_model=BaseNewsModel,
                   name="news_post")
 async def create_news(news: BaseNewsModel,
-                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)]
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                      cache: Annotated[CacheBackend, Depends(get_cache)]
                       ) -> BaseNewsModel:
     """
     Creating a news item
     """
     news_dict = news.model_dump()
     await news_repo.add_one(news_dict)
+    await cache.invalidate(*news_keys())
     return news
 
 
@@ -31,15 +50,17 @@ async def create_news(news: BaseNewsModel,
                             "description": "News with this ID does not exist or it has been deleted"}
                     })
 async def delete_news(id: int,
-                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)]
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                      cache: Annotated[CacheBackend, Depends(get_cache)]
                       ):
     """
     Assign "Deleted" status to a news item
     """
-    if not await news_repo.find_one(record_id=id):
+    news = await news_repo.update_one_returning(record_id=id, data={"is_deleted": True}, notify_event="delete")
+    if not news:
         raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been deleted")
-    await news_repo.update_one(record_id=id, data={"is_deleted": True})
-    return await news_repo.find_one(record_id=id)
+    await cache.invalidate(*news_keys(id))
+    return news
 
 
 @news_router.patch("",
@@ -51,51 +72,220 @@ async def delete_news(id: int,
                    })
 async def update_news(news: BaseNewsModel,
                       news_id: int,
-                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)]
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                      cache: Annotated[CacheBackend, Depends(get_cache)]
                       ) -> BaseNewsModel:
     """
     Update the news data
     """
-    news_dict = news.model_dump()
-    if not await news_repo.find_one(record_id=news_id):
+    updated = await news_repo.update_one_returning(record_id=news_id, data=news.model_dump(), notify_event="update")
+    if not updated:
         raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been")
-    await news_repo.update_one(record_id=news_id, data=news_dict)
-    return await news_repo.find_one(record_id=news_id)
+    await cache.invalidate(*news_keys(news_id))
+    return updated
+
+
+async def change_news_status(ids: list[int], deleted: bool, news_repo: NewsRepository, cache: CacheBackend):
+    changed = await news_repo.soft_delete_many(ids, deleted=deleted, notify_event="delete" if deleted else "restore")
+    await cache.invalidate(*{prefix for news_id in changed for prefix in news_keys(news_id)})
+    return {"changed": changed, "unchanged": sorted(set(ids) - set(changed))}
+
+
+@news_router.post("/bulk/delete",
+                  response_model=NewsStatusChangeModel,
+                  name="news_bulk_delete")
+async def delete_news_many(news_ids: NewsIdsModel,
+                           news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                           cache: Annotated[CacheBackend, Depends(get_cache)]
+                           ) -> dict[str, list[int]]:
+    """
+    Assign "Deleted" status to several news items in one statement
+    """
+    return await change_news_status(news_ids.ids, True, news_repo, cache)
+
+
+@news_router.post("/bulk/restore",
+                  response_model=NewsStatusChangeModel,
+                  name="news_bulk_restore")
+async def restore_news_many(news_ids: NewsIdsModel,
+                            news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
+                            cache: Annotated[CacheBackend, Depends(get_cache)]
+                            ) -> dict[str, list[int]]:
+    """
+    Remove "Deleted" status from several news items in one statement
+    """
+    return await change_news_status(news_ids.ids, False, news_repo, cache)
 
 
 @news_router.get("",
                  response_model=GetNewsListModel,
-                 name="news_list"
-                 )
-async def get_news(news_repo: Annotated[NewsRepository, Depends(NewsRepository)],
-                   comments_repo: Annotated[CommentsRepository, Depends(CommentsRepository)]
-                   ) -> dict[str, int | Any]:
+                 name="news_list",
+                 responses={
+                     status.HTTP_304_NOT_MODIFIED: {"description": "The page matches the If-None-Match ETag"}
+                 })
+async def get_news(request: Request,
+                   news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)],
+                   pagination: Annotated[Pagination, Depends()],
+                   cache: Annotated[CacheBackend, Depends(get_cache)]
+                   ) -> Response:
     """
-    Get a list of all news
+    Get a page of news, newest first
     """
-    news = await news_repo.find_all(conditions={"is_deleted": False})
-    for element in news:
-        element.comments_count = await comments_repo.comments_count(element.id)
-    print(news)
-    return {"news": news, "news_count": len(news)}
+    fingerprint = await news_repo.find_page_fingerprint(conditions={"is_deleted": False},
+                                                        limit=pagination.limit,
+                                                        after=pagination.after,
+                                                        descending=True)
+    etag = make_etag(fingerprint, pagination.limit, pagination.after)
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    async def load():
+        news, next_cursor = await news_repo.find_page(conditions={"is_deleted": False},
+                                                      limit=pagination.limit,
+                                                      after=pagination.after,
+                                                      descending=True)
+        logger.debug("Loaded news page: %r", news)
+        return dump_json({"news": [row_dict(element, NEWS_FIELDS) for element in news],
+                          "news_count": len(news),
+                          "next_cursor": next_cursor})
+
+    return JSONBytesResponse(await cache.get_or_set(news_list_key(etag), load), headers={"ETag": etag})
+
+
+@news_router.get("/export",
+                 name="news_export",
+                 response_class=Response,
+                 responses={
+                     status.HTTP_200_OK: {"content": {"application/x-ndjson": {}, "text/csv": {}},
+                                          "description": "News with their comments, oldest first"}
+                 })
+async def export_news(request: Request,
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)],
+                      export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                      date_from: datetime | None = None,
+                      date_to: datetime | None = None
+                      ) -> Response:
+    """
+    Export not deleted news published in [date_from, date_to) with their comments: one JSON document per news item
+    or one CSV row per comment
+    """
+    rows = news_repo.stream_with_comments(date_from=date_from, date_to=date_to, yield_per=STREAM_BATCH_SIZE)
+    if export_format == "csv":
+        chunks, media_type = csv_chunks(csv_rows(rows), CSV_HEADER), "text/csv"
+    else:
+        chunks, media_type = ndjson_chunks(news_documents(rows)), "application/x-ndjson"
+    return streaming_export(chunks, media_type, f"news.{export_format}", gzip=accepts_gzip(request))
+
+
+@news_router.get("/search",
+                 response_model=NewsSearchModel,
+                 name="news_search")
+async def search_news(news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)],
+                      pagination: Annotated[RankPagination, Depends()],
+                      q: str = Query(min_length=1, max_length=256,
+                                     description='Search text: words, "quoted phrases", "or", -excluded'),
+                      comments: bool = Query(False, description="Also find news by the text of their comments")
+                      ) -> dict[str, Any]:
+    """
+    Search news by title and body, best matches first, with the matching fragments highlighted by <b></b>
+    """
+    results, next_cursor = await news_repo.search(q, with_comments=comments,
+                                                  limit=pagination.limit,
+                                                  after=pagination.after)
+    return {"results": results, "next_cursor": next_cursor}
 
 
 @news_router.get("/{id}",
                  response_model=GetNewsCommentsModel,
                  name="news_comments",
                  responses={
+                     status.HTTP_304_NOT_MODIFIED: {"description": "The news matches the If-None-Match ETag"},
                      status.HTTP_404_NOT_FOUND: {"description": "News with this ID does not exist or it has been"}
                  })
 async def get_news_by_id(id: int,
-                         comments_repo: Annotated[CommentsRepository, Depends(CommentsRepository)],
-                         news_repo: Annotated[NewsRepository, Depends(NewsRepository)]
-                         ) -> dict[str, int | Any]:
+                         request: Request,
+                         news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)],
+                         pagination: Annotated[Pagination, Depends()],
+                         cache: Annotated[CacheBackend, Depends(get_cache)]
+                         ) -> Response:
     """
-    Get news by ID
+    Get news by ID with a page of its comments, oldest first
     """
-    news = await news_repo.get_one(record_id=id)
-    if not news or news.is_deleted == True:
+    fingerprint = await news_repo.find_fingerprint(record_id=id)
+    if not fingerprint or fingerprint.is_deleted:
         raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been")
-    news.comments_count = await comments_repo.comments_count(news_id=id)
-    news.comments = await comments_repo.find_all(conditions={"news_id": id})
-    return news
+    etag = make_etag(tuple(fingerprint), pagination.limit, pagination.after)
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    async def load():
+        return await news_repo.find_document(record_id=id, limit=pagination.limit, after=pagination.after)
+
+    content = await cache.get_or_set(news_item_key(id, etag), load)
+    if content is None:
+        raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been")
+    return JSONBytesResponse(content, headers={"ETag": etag})
+
+
+@news_router.get("/{id}/comments",
+                 response_model=List[GetCommentModel],
+                 name="news_comments_stream",
+                 responses={
+                     status.HTTP_404_NOT_FOUND: {"description": "News with this ID does not exist or it has been"}
+                 })
+async def stream_news_comments(id: int,
+                               comments_repo: Annotated[CommentsRepository, Depends(CommentsRepository.reader)],
+                               news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)]
+                               ) -> Response:
+    """
+    Get all comments of the news, oldest first, as a JSON array streamed from a server-side cursor
+    """
+    fingerprint = await news_repo.find_fingerprint(record_id=id)
+    if not fingerprint or fingerprint.is_deleted:
+        raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been")
+
+    async def rows():
+        async for comment in comments_repo.stream_all(conditions={"news_id": id}, yield_per=STREAM_BATCH_SIZE):
+            yield row_dict(comment, COMMENT_FIELDS)
+
+    return streaming_json_array(rows())
+
+
+@news_router.get("/{id}/events",
+                 name="news_events",
+                 response_class=StreamingResponse,
+                 responses={
+                     status.HTTP_200_OK: {"content": {"text/event-stream": {}},
+                                          "description": "comment, update, delete, restore and resync events"},
+                     status.HTTP_404_NOT_FOUND: {
+                         "description": "News with this ID does not exist or it has been deleted"}
+                 })
+async def news_events(id: int,
+                      request: Request,
+                      news_repo: Annotated[NewsRepository, Depends(NewsRepository.reader)],
+                      events: Annotated[NewsEvents, Depends(get_news_events)]
+                      ) -> StreamingResponse:
+    """
+    Server-Sent Events about the news item as they are committed; a resync event means some were missed and
+    the news should be fetched again
+    """
+    fingerprint = await news_repo.find_fingerprint(record_id=id)
+    if not fingerprint or fingerprint.is_deleted:
+        raise HTTPException(status_code=404, detail="News with this ID does not exist or it has been deleted")
+    # the stream may stay open for hours, it must not hold a pooled connection
+    await news_repo.session.close()
+    # connect before the response starts, so a database that is down is still an error status
+    await events.listen()
+
+    async def stream():
+        # subscribed only while the body is iterated, so a response that is never sent leaves nothing behind
+        subscription = await events.subscribe(id)
+        try:
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=events.heartbeat_seconds)
+                yield sse_message(event) if event else SSE_HEARTBEAT
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,17 @@
+import asyncio
+
+from database import open_database
+from news.repository import NewsRepository
+
+
+async def reconcile_comments_count():
+    """
+    Repair drift between News.comments_count and the actual number of comments
+    """
+    async with open_database() as database, database.session_maker() as session:
+        return await NewsRepository(session).reconcile_comments_count()
+
+
+if __name__ == "__main__":
+    fixed = asyncio.run(reconcile_comments_count())
+    print(f"Reconciled comments_count for {fixed} news")
@@ -1,21 +1,228 @@
 import random
+from datetime import datetime, timezone
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index, select, func, update, insert, literal, \
+    tuple_, union_all, true, literal_column, cast, Text
+from sqlalchemy.dialects.postgresql import TSVECTOR, aggregate_order_by
+from sqlalchemy.orm import deferred
 
+from comments.repository import Comments
+from comments.schemas import GetCommentModel
 from database import Base
+from news.events import NEWS_EVENTS_CHANNEL
+from news.schemas import GetNewsModel
+from utils.pagination import encode_cursor, encode_rank_cursor
 from utils.repository import SQLAlchemyRepository
+from utils.responses import dump_json
+from utils.search import headline, search_query, weighted_tsvector
+from utils.sql_json import EMPTY_JSON_ARRAY, json_fields, json_object
+
+NEWS_FIELDS = tuple(GetNewsModel.model_fields)
+COMMENT_FIELDS = tuple(GetCommentModel.model_fields)
+COMMENT_RANK_WEIGHT = 0.5
+
+
+def notify_news_event(event: str, news_id, **fields):
+    """
+    pg_notify of a news event; the JSON payload carries the event name, the news id and the extra fields
+    """
+    payload = func.json_build_object(literal_column("'event'"), literal(event, String),
+                                     literal_column("'news_id'"), news_id,
+                                     *(part for name, value in fields.items()
+                                       for part in (literal_column(f"'{name}'"), value)))
+    return func.pg_notify(NEWS_EVENTS_CHANNEL, cast(payload, Text))
 
 
 class News(Base):
     __tablename__ = 'News'
-    __table_args__ = {'extend_existing': True}
 
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     date = Column(DateTime(timezone=True), nullable=False)
     body = Column(String, nullable=False)
     is_deleted = Column(Boolean, nullable=False, default=False)
+    comments_count = Column(Integer, nullable=False, default=0, server_default='0')
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # deferred so that ordinary loads never fetch it
+    search_vector = deferred(Column(TSVECTOR, weighted_tsvector(("title", "A"), ("body", "B"))))
+
+    __table_args__ = (
+        Index('ix_News_date_id_not_deleted', date.desc(), id.desc(), postgresql_where=~is_deleted),
+        Index('ix_News_search_vector', 'search_vector', postgresql_using='gin'),
+        {'extend_existing': True},
+    )
 
 
 class NewsRepository(SQLAlchemyRepository):
     model = News
+
+    def update_values(self) -> dict:
+        return {"version": self.model.version + 1}
+
+    def event_notification(self, event: str, record_id):
+        return notify_news_event(event, record_id)
+
+    async def find_fingerprint(self, record_id: int):
+        """
+        Get only the columns an item's ETag is derived from
+        """
+        query = (select(self.model.id, self.model.version, self.model.comments_count, self.model.is_deleted)
+                 .where(self.model.id == record_id))
+        result = await self.session.execute(query)
+        return result.one_or_none()
+
+    async def find_page_fingerprint(self, conditions: dict = None, limit: int = 50, after: tuple = None,
+                                    descending=False):
+        """
+        Get only the columns a page's ETag is derived from, for the same rows find_page would return
+        """
+        query = self.where_conditions(select(self.model.id, self.model.version, self.model.comments_count),
+                                      conditions)
+        query = self.paginate(query, limit=limit, after=after, descending=descending)
+        result = await self.session.execute(query)
+        return [tuple(row) for row in result.all()]
+
+    async def find_document(self, record_id: int, limit: int = 50, after: tuple = None) -> bytes | None:
+        """
+        Get a not deleted news item with a page of its comments, oldest first, as the JSON of GetNewsCommentsModel
+        built by the database in one query; None means there is no such news
+        """
+        page = select(*(getattr(Comments, field) for field in COMMENT_FIELDS)).where(Comments.news_id == record_id)
+        if after:
+            page = page.where(tuple_(Comments.date, Comments.id) > tuple_(*after))
+        page = page.order_by(Comments.date, Comments.id).limit(limit + 1).subquery("page")
+        numbered = select(page, func.row_number().over(order_by=(page.c.date, page.c.id)).label("position")) \
+            .subquery("numbered")
+        last = numbered.c.position == limit
+        comments = select(
+            func.coalesce(func.json_agg(aggregate_order_by(json_object(json_fields(numbered.c, COMMENT_FIELDS)),
+                                                           numbered.c.position))
+                          .filter(numbered.c.position <= limit), EMPTY_JSON_ARRAY).label("comments"),
+            func.count().label("fetched"),
+            func.max(numbered.c.date).filter(last).label("last_date"),
+            func.max(numbered.c.id).filter(last).label("last_id"),
+        ).subquery("comments_page")
+
+        document = json_object({**json_fields(self.model, NEWS_FIELDS), "comments": comments.c.comments})
+        stmt = (select(document.label("document"), comments.c.fetched, comments.c.last_date, comments.c.last_id)
+                .select_from(self.model)
+                .join(comments, true())
+                .where(self.model.id == record_id, ~self.model.is_deleted))
+        result = await self.session.execute(stmt)
+        row = result.one_or_none()
+        if row is None:
+            return None
+        # the look-ahead row tells whether there is a next page; its cursor points at the last row of this one
+        next_cursor = encode_cursor(row.last_date, row.last_id) if row.fetched > limit else None
+        return row.document[:-1].encode() + b',"next_cursor":' + dump_json(next_cursor) + b"}"
+
+    async def warm_up(self):
+        """
+        Run the hot read queries once, so a fresh connection has them compiled and prepared before real traffic
+        """
+        after = (datetime.now(timezone.utc), 0)
+        for page_after in (None, after):
+            await self.find_page_fingerprint(conditions={"is_deleted": False}, after=page_after, descending=True)
+            await self.find_page(conditions={"is_deleted": False}, after=page_after, descending=True)
+            await self.find_document(record_id=0, after=page_after)
+        await self.find_fingerprint(record_id=0)
+
+    def comments_count_update(self, news_id, delta: int = 1):
+        """
+        UPDATE shifting the stored comment counter, to run in the same statement or transaction as the comment
+        """
+        return (update(self.model)
+                .where(self.model.id == news_id)
+                .values(comments_count=self.model.comments_count + delta))
+
+    async def add_comment(self, data: dict, commit=False):
+        """
+        Bump the news comment counter, insert the comment and notify the news event listeners in one statement;
+        None means there is no such news
+        """
+        counted = self.comments_count_update(data["news_id"]).returning(self.model.id).cte("counted")
+        columns = [key for key in data if key != "news_id"]
+        rows = select(counted.c.id, *(literal(data[key], getattr(Comments, key).type) for key in columns))
+        inserted = (insert(Comments)
+                    .from_select(["news_id", *columns], rows)
+                    .returning(Comments.id, Comments.news_id)
+                    .cte("inserted"))
+        stmt = select(inserted.c.id, notify_news_event("comment", inserted.c.news_id, comment_id=inserted.c.id))
+        result = await self.session.execute(stmt)
+        comment_id = result.scalar_one_or_none()
+        if commit:
+            await self.session.commit()
+        return comment_id
+
+    async def search(self, text: str, with_comments=False, limit: int = 50, after: tuple = None):
+        """
+        Get a page of not deleted news matching the text, best ranked first, with highlighted title and body
+        fragments; with_comments also finds news by their comments, ranked below matches in the news itself
+        """
+        query = search_query(text)
+        matches = (select(self.model.id.label("news_id"),
+                          func.ts_rank_cd(self.model.search_vector, query).label("rank"))
+                   .where(self.model.search_vector.op("@@")(query)))
+        if with_comments:
+            comment_matches = (select(Comments.news_id,
+                                      (func.ts_rank_cd(Comments.search_vector, query) * COMMENT_RANK_WEIGHT)
+                                      .label("rank"))
+                               .where(Comments.search_vector.op("@@")(query)))
+            found = union_all(matches, comment_matches).subquery()
+            matches = select(found.c.news_id, func.max(found.c.rank).label("rank")).group_by(found.c.news_id)
+        matches = matches.subquery()
+
+        key = tuple_(matches.c.rank, matches.c.news_id)
+        page = (select(matches.c.news_id, matches.c.rank)
+                .join(self.model, self.model.id == matches.c.news_id)
+                .where(~self.model.is_deleted))
+        if after:
+            page = page.where(key < tuple_(*after))
+        page = page.order_by(matches.c.rank.desc(), matches.c.news_id.desc()).limit(limit + 1).subquery()
+
+        # the highlights are built only for the rows of the page, ts_headline reparses the whole text
+        stmt = (select(self.model.id, self.model.title, self.model.date, self.model.comments_count, page.c.rank,
+                       headline(self.model.title, query).label("title_highlight"),
+                       headline(self.model.body, query).label("snippet"))
+                .join(page, page.c.news_id == self.model.id)
+                .order_by(page.c.rank.desc(), self.model.id.desc()))
+        result = await self.session.execute(stmt)
+        rows = result.all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_rank_cursor(rows[-1].rank, rows[-1].id)
+
+    async def reconcile_comments_count(self):
+        """
+        Recount comments for every news item whose stored counter has drifted
+        """
+        actual = (select(func.count(Comments.id))
+                  .where(Comments.news_id == self.model.id)
+                  .correlate(self.model)
+                  .scalar_subquery())
+        stmt = update(self.model).where(self.model.comments_count != actual).values(comments_count=actual)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def stream_with_comments(self, date_from: datetime | None = None, date_to: datetime | None = None,
+                                   yield_per: int = 1000):
+        """
+        Iterate over not deleted news joined with their comments, oldest first, through a server-side cursor;
+        a news item without comments comes as one row with empty comment columns
+        """
+        query = (select(self.model.id, self.model.title, self.model.date, self.model.body,
+                        self.model.comments_count,
+                        Comments.id.label("comment_id"), Comments.title.label("comment_title"),
+                        Comments.date.label("comment_date"), Comments.comment)
+                 .outerjoin(Comments, Comments.news_id == self.model.id)
+                 .where(~self.model.is_deleted)
+                 .order_by(self.model.date, self.model.id, Comments.date, Comments.id))
+        if date_from:
+            query = query.where(self.model.date >= date_from)
+        if date_to:
+            query = query.where(self.model.date < date_to)
+        result = await self.session.stream(query.execution_options(yield_per=yield_per))
+        async for row in result:
+            yield row
@@ -21,7 +21,33 @@ class GetNewsModel(BaseNewsModel):
 class GetNewsListModel(BaseModel):
     news: List[GetNewsModel]
     news_count: int
+    next_cursor: str | None = None
 
 
 class GetNewsCommentsModel(GetNewsModel):
     comments: List[GetCommentModel] | None = None
+    next_cursor: str | None = None
+
+
+class NewsIdsModel(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=1000)
+
+
+class NewsStatusChangeModel(BaseModel):
+    changed: List[int]
+    unchanged: List[int]
+
+
+class NewsSearchResultModel(BaseModel):
+    id: int
+    title: str
+    date: datetime
+    comments_count: int | None = None
+    rank: float
+    title_highlight: str
+    snippet: str
+
+
+class NewsSearchModel(BaseModel):
+    results: List[NewsSearchResultModel]
+    next_cursor: str | None = None
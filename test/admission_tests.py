@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from fastapi import status
+
+from main import app
+from utils import metrics
+from utils.admission import BULK, CHEAP, AdmissionControl, ConcurrencyLimiter, Shed
+
+
+@pytest.fixture
+def busy_client(test_client):
+    app.state.admission = AdmissionControl(limit=1, queue_size=0, retry_after=3,
+                                           excluded_routes=["GET /metrics"])
+    # every slot is taken by a request that never finishes
+    app.state.admission.limiter.in_flight = 1
+    yield test_client
+    del app.state.admission
+
+
+@pytest.mark.asyncio
+async def test_cheap_waiters_go_first():
+    limiter = ConcurrencyLimiter("test", limit=1, queue_size=2, timeout=1.0)
+    await limiter.acquire()
+    bulk = asyncio.create_task(limiter.acquire(BULK))
+    cheap = asyncio.create_task(limiter.acquire(CHEAP))
+    await asyncio.sleep(0)
+
+    limiter.release()
+    await cheap
+    assert not bulk.done()
+
+    limiter.release()
+    await bulk
+    limiter.release()
+    assert limiter.in_flight == 0
+    assert limiter.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_sheds_bulk_first():
+    limiter = ConcurrencyLimiter("test", limit=1, queue_size=1, timeout=1.0)
+    await limiter.acquire()
+    bulk = asyncio.create_task(limiter.acquire(BULK))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Shed, match="queue_full"):
+        await limiter.acquire(BULK)
+    cheap = asyncio.create_task(limiter.acquire(CHEAP))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Shed, match="evicted"):
+        await bulk
+    limiter.release()
+    await cheap
+    assert limiter.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_eviction_skips_cancelled_waiter():
+    limiter = ConcurrencyLimiter("test", limit=1, queue_size=1, timeout=1.0)
+    await limiter.acquire()
+    bulk = asyncio.create_task(limiter.acquire(BULK))
+    await asyncio.sleep(0)
+    # cancelled like wait_for does on a timeout, before the waiting task resumes to leave the queue
+    limiter.waiters[BULK][0].cancel()
+
+    cheap = asyncio.create_task(limiter.acquire(CHEAP))
+    await asyncio.sleep(0)
+    limiter.release()
+
+    await cheap
+    with pytest.raises((Shed, asyncio.CancelledError)):
+        await bulk
+    assert limiter.in_flight == 1
+    assert limiter.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_wait_times_out():
+    limiter = ConcurrencyLimiter("test", limit=1, queue_size=1, timeout=0.01)
+    await limiter.acquire()
+
+    with pytest.raises(Shed, match="timeout"):
+        await limiter.acquire()
+    assert limiter.queued() == 0
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_saturated_route_gets_503(busy_client):
+    shed = metrics.REQUESTS_SHED.labels(method="GET", route="/news/{id}", reason="queue_full")
+    before = shed._value.get()
+
+    response = busy_client.get("/news/1")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "3"
+    assert shed._value.get() == before + 1
+    assert busy_client.get("/metrics").status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_route_limit_below_shared_limit():
+    admission = AdmissionControl(limit=5, queue_size=0, route_limits={"GET /news/export": 1},
+                                 bulk_routes=["GET /news/export"])
+
+    async with admission.admit("GET /news/export"):
+        with pytest.raises(Shed):
+            async with admission.admit("GET /news/export"):
+                pass
+        async with admission.admit("GET /news/{id}"):
+            assert admission.stats()["shared"]["in_flight"] == 2
+    assert admission.stats()["GET /news/export"]["in_flight"] == 0
@@ -0,0 +1,30 @@
+from benchmark.run import compare, percentile, summarize
+from benchmark.seed import dsn
+from config import Settings
+from database import database_url
+
+
+def test_percentile_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 99) == 0.0
+
+
+def test_compare_reports_regressions():
+    baseline = {"scenarios": {"news_list": summarize([0.010] * 100, 0, 1.0, 100)}}
+    current = {"scenarios": {"news_list": summarize([0.010] * 90 + [0.050] * 10, 0, 1.0, 100)}}
+
+    assert compare(baseline, baseline, tolerance=0.1) == []
+    assert compare(baseline, current, tolerance=0.1) == ["news_list: p95 10.0ms -> 50.0ms",
+                                                          "news_list: p99 10.0ms -> 50.0ms"]
+
+
+def test_seed_dsn_is_the_app_database(mocker):
+    settings = Settings(DB_HOST="db", DB_PORT="5433", DB_NAME="news", DB_USER="app", DB_PASS="p@ss")
+    mocker.patch("benchmark.seed.get_settings", return_value=settings)
+
+    assert dsn() == database_url(settings).replace("postgresql+asyncpg://", "postgresql://")
+    assert dsn() == "postgresql://app:p%40ss@db:5433/news"
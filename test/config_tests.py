@@ -0,0 +1,27 @@
+import pytest
+from pydantic import ValidationError
+
+from config import Settings
+
+DB = {"DB_HOST": "localhost", "DB_PORT": "5432", "DB_NAME": "postgres", "DB_USER": "postgres", "DB_PASS": "postgres"}
+
+
+def test_pool_fits_connection_budget():
+    settings = Settings(**DB, WEB_WORKERS=4, DB_POOL_SIZE=5, DB_MAX_OVERFLOW=5, DB_MAX_CONNECTIONS=40)
+
+    assert settings.DB_POOL_SIZE == 5
+
+
+def test_pool_exceeds_connection_budget():
+    with pytest.raises(ValidationError, match="exceeds DB_MAX_CONNECTIONS"):
+        Settings(**DB, WEB_WORKERS=4, DB_POOL_SIZE=10, DB_MAX_OVERFLOW=5, DB_MAX_CONNECTIONS=40)
+
+
+def test_warmup_connections_fit_pool():
+    with pytest.raises(ValidationError, match="DB_WARMUP_CONNECTIONS"):
+        Settings(**DB, DB_POOL_SIZE=5, DB_WARMUP_CONNECTIONS=6)
+
+
+def test_admission_route_keys():
+    with pytest.raises(ValidationError, match="must look like"):
+        Settings(**DB, ADMISSION_BULK_ROUTES=["/news"])
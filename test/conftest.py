@@ -0,0 +1,16 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from test.helpers import make_test_database
+
+
+@pytest.fixture
+def test_client():
+    """
+    TestClient running the app lifespan against a test Database instead of the one built from .env
+    """
+    app.state.database = make_test_database()
+    with TestClient(app) as client:
+        yield client
+    del app.state.database
@@ -0,0 +1,145 @@
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from database import PRIMARY_COOKIE, ReplicaHealth, get_async_session, get_read_session
+from test.helpers import make_test_database
+
+
+def session_maker(session):
+    @asynccontextmanager
+    async def make():
+        yield session
+
+    return make
+
+
+async def read_session(database, cookies=None):
+    request = MagicMock()
+    request.cookies = cookies or {}
+    sessions = get_read_session(request, database)
+    session = await anext(sessions)
+    await sessions.aclose()
+    return session
+
+
+@pytest.fixture
+def database():
+    return make_test_database()
+
+
+@pytest.fixture
+def sessions(database):
+    primary = MagicMock(name="primary")
+    replica = MagicMock(name="replica")
+    replica.connection = AsyncMock()
+    database.read_session_maker = session_maker(primary)
+    database.replica_session_maker = session_maker(replica)
+    database.replica_health = ReplicaHealth(retry_seconds=60)
+    return primary, replica
+
+
+@pytest.mark.asyncio
+async def test_read_session_uses_replica(database, sessions):
+    primary, replica = sessions
+
+    assert await read_session(database) is replica
+
+
+@pytest.mark.asyncio
+async def test_read_session_after_write_uses_primary(database, sessions):
+    primary, replica = sessions
+
+    assert await read_session(database, {PRIMARY_COOKIE: "1"}) is primary
+
+
+@pytest.mark.asyncio
+async def test_read_session_falls_back_to_primary(database, sessions):
+    primary, replica = sessions
+    replica.connection.side_effect = OSError("Connect call failed")
+
+    assert await read_session(database) is primary
+    assert await read_session(database) is primary
+    replica.connection.assert_awaited_once()
+
+
+def write_session_maker(database):
+    session = MagicMock(name="write")
+    session.commit = AsyncMock()
+    session.rollback = AsyncMock()
+    database.session_maker = session_maker(session)
+    return session
+
+
+def method_request(method):
+    request = MagicMock()
+    request.method = method
+    return request
+
+
+@pytest.mark.asyncio
+async def test_get_request_session_is_read_only(database, sessions):
+    primary, replica = sessions
+    write = write_session_maker(database)
+    sessions = get_async_session(method_request("GET"), database)
+
+    assert await anext(sessions) is primary
+    with pytest.raises(StopAsyncIteration):
+        await anext(sessions)
+    write.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_write_session_commits_once(database):
+    write = write_session_maker(database)
+    request = method_request("POST")
+    sessions = get_async_session(request, database)
+
+    assert await anext(sessions) is write
+    assert request.state.write_session is write
+    with pytest.raises(StopAsyncIteration):
+        await anext(sessions)
+    write.commit.assert_awaited_once()
+    write.rollback.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_write_session_rolls_back_on_error(database):
+    write = write_session_maker(database)
+    sessions = get_async_session(method_request("POST"), database)
+    await anext(sessions)
+
+    with pytest.raises(RuntimeError):
+        await sessions.athrow(RuntimeError("boom"))
+    write.rollback.assert_awaited_once()
+    write.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_opens_connections_and_runs_queries(database):
+    opened = []
+
+    def make_session():
+        session = MagicMock()
+        session.connection = AsyncMock()
+        opened.append(session)
+        return session_maker(session)()
+
+    database.read_session_maker = make_session
+    queries = AsyncMock()
+
+    await database.warm_up(3, queries)
+
+    assert len(opened) == 3
+    assert all(session.connection.await_count == 1 for session in opened)
+    assert [call.args[0] for call in queries.await_args_list] == opened
+
+
+@pytest.mark.asyncio
+async def test_warm_up_survives_database_down(database):
+    session = MagicMock()
+    session.connection = AsyncMock(side_effect=OSError("Connect call failed"))
+    database.read_session_maker = session_maker(session)
+
+    await database.warm_up(2)
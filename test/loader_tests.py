@@ -0,0 +1,119 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi import status
+
+from database import get_async_session
+from loader.data_loader import MalformedRecord, RecordDecoder
+from main import app
+from utils.cache import MemoryCache, get_cache
+
+
+@pytest.fixture
+def test_client(test_client):
+    app.dependency_overrides[get_cache] = lambda: MemoryCache(max_size=16, ttl=60)
+    yield test_client
+    app.dependency_overrides.pop(get_cache)
+
+
+def test_record_decoder_json_array_split_across_chunks():
+    decoder = RecordDecoder()
+    data = '[{"title": "News 1", "body": "Б"}, {"title": "News 2"}]'.encode()
+
+    records = decoder.feed(data[:20]) + decoder.feed(data[20:40]) + decoder.feed(data[40:])
+    decoder.close()
+
+    assert records == [{"title": "News 1", "body": "Б"}, {"title": "News 2"}]
+
+
+def test_record_decoder_json_lines_truncated():
+    decoder = RecordDecoder()
+
+    assert decoder.feed(b'{"title": "News 1"}\n{"title": "Ne') == [{"title": "News 1"}]
+    with pytest.raises(ValueError):
+        decoder.close()
+
+
+def test_record_decoder_json_lines_skips_malformed_line():
+    decoder = RecordDecoder()
+    body = '{"a": 1}\n{"a": 2,}\n' + "".join(f'{{"a": {i}}}\n' for i in range(3, 1003))
+
+    records = [record for start in range(0, len(body), 100) for record in decoder.feed(body[start:start + 100])]
+    decoder.close()
+
+    assert records[0] == {"a": 1}
+    assert isinstance(records[1], MalformedRecord)
+    assert "{\"a\": 2,}" in records[1].detail
+    assert records[2:] == [{"a": i} for i in range(3, 1003)]
+    assert len(decoder._buffer) < 100
+
+
+def test_record_decoder_json_array_skips_malformed_record():
+    decoder = RecordDecoder()
+
+    records = decoder.feed(b'[{"a": 1}, {"a": 2,},\n{"a": 3}]')
+    decoder.close()
+
+    assert [record for record in records if not isinstance(record, MalformedRecord)] == [{"a": 1}, {"a": 3}]
+    assert sum(isinstance(record, MalformedRecord) for record in records) == 1
+
+
+def test_record_decoder_pretty_printed_array_skips_whole_malformed_object():
+    decoder = RecordDecoder()
+    body = b"""[
+  {
+    "title": "Broken, with a comma",
+    "comments": [{"title": "Nested"}],
+    "body": "Body",
+  },
+  {
+    "title": "Valid"
+  }
+]"""
+
+    records = decoder.feed(body[:60]) + decoder.feed(body[60:])
+    decoder.close()
+
+    assert len(records) == 2
+    assert isinstance(records[0], MalformedRecord)
+    assert records[1] == {"title": "Valid"}
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_news(test_client):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = [10, 11]
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=result)
+    session.commit = AsyncMock()
+
+    async def fake_session():
+        yield session
+
+    body = "\n".join([
+        '{"title": "News 1", "date": "2024-04-14T12:00:00", "body": "Body 1",'
+        ' "comments": [{"title": "Comment 1", "date": "2024-04-14T12:00:00", "comment": "Comment 1"}]}',
+        '{"title": "Invalid"}',
+        '{"title": "Broken",}',
+        '{"title": "News 2", "date": "2024-04-15T12:00:00", "body": "Body 2"}',
+    ])
+    app.dependency_overrides[get_async_session] = fake_session
+    try:
+        response = test_client.post("/news/bulk", content=body, params={"batch_size": 10})
+    finally:
+        app.dependency_overrides.pop(get_async_session)
+
+    assert response.status_code == status.HTTP_200_OK
+    report = response.json()
+    assert report["inserted_news"] == 2
+    assert report["inserted_comments"] == 1
+    assert report["batches"] == 1
+    assert report["error_count"] == 2
+    assert report["errors"][0]["record"] == 1
+    assert report["errors"][1]["record"] == 2
+    assert "Malformed JSON record" in report["errors"][1]["detail"]
+
+    news_rows = session.execute.await_args_list[0].args[1]
+    assert [row["comments_count"] for row in news_rows] == [1, 0]
+    comment_rows = session.execute.await_args_list[1].args[1]
+    assert comment_rows[0]["news_id"] == 10
@@ -0,0 +1,36 @@
+import json
+import logging
+
+from utils.log import JsonFormatter, RequestIdFilter, SamplingFilter, request_id
+
+
+def make_record(level=logging.INFO, **extra):
+    record = logging.makeLogRecord({"name": "app.requests", "levelno": level, "levelname": logging.getLevelName(level),
+                                    "msg": "GET %s", "args": ("/news",)})
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_request_id_and_extra():
+    record = make_record(route="/news", queries=2)
+    token = request_id.set("abc")
+    try:
+        RequestIdFilter().filter(record)
+    finally:
+        request_id.reset(token)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "GET /news"
+    assert entry["request_id"] == "abc"
+    assert entry["route"] == "/news"
+    assert entry["queries"] == 2
+
+
+def test_sampling_filter_keeps_errors_and_other_routes():
+    sampler = SamplingFilter(["/news"], rate=0.0)
+
+    assert not sampler.filter(make_record(route="/news", status=200))
+    assert sampler.filter(make_record(route="/news", status=503))
+    assert sampler.filter(make_record(logging.WARNING, route="/news", status=200))
+    assert sampler.filter(make_record(route="/comments", status=200))
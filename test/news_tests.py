@@ -1,18 +1,44 @@
-from unittest.mock import AsyncMock
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from fastapi import HTTPException, status
-from fastapi.testclient import TestClient
+from sqlalchemy import Text, create_engine, literal, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.util import greenlet_spawn
 
 from comments.repository import CommentsRepository, Comments
+from database import Base, get_read_session
 from main import app
-from news.news import delete_news
+from news.events import RESYNC_EVENT, SSE_HEARTBEAT, NewsEvents, listen_dsn
+from news.news import delete_news, news_events
+from news.news import NEWS_FIELDS
 from news.repository import NewsRepository, News
+from comments.schemas import GetCommentModel
+from news.schemas import GetNewsCommentsModel, GetNewsModel
+from test.helpers import assert_max_queries, make_test_database, query_count, requires_database
+from utils import metrics
+from utils.cache import MemoryCache, get_cache
+from utils.instrumentation import RequestStats, after_cursor_execute, before_cursor_execute, \
+    install_query_listeners, request_stats
+from utils.pagination import decode_cursor, decode_rank_cursor, encode_rank_cursor
+from utils.responses import dump_json, row_dict
+from utils.search import headline, search_query
 
+Fingerprint = namedtuple("Fingerprint", "id version comments_count is_deleted")
 
-@pytest.fixture
-def test_client():
-    return TestClient(app)
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    cache = MemoryCache(max_size=16, ttl=60)
+    app.dependency_overrides[get_cache] = lambda: cache
+    yield cache
+    app.dependency_overrides.pop(get_cache, None)
 
 
 @pytest.mark.asyncio
@@ -38,21 +64,21 @@ async def test_create_news(test_client):
 async def test_delete_news_successful(mocker):
     news_instance = News(id=1, title="Test News", date="2024-04-14T12:00:00", body="Some body", is_deleted=True)
 
-    mocker.patch.object(NewsRepository, 'find_one', return_value=news_instance)
-    mocker.patch.object(NewsRepository, 'update_one', new_callable=AsyncMock, return_value=1)
+    update = mocker.patch.object(NewsRepository, 'update_one_returning', return_value=news_instance)
 
-    response = await delete_news(id=1)
+    response = await delete_news(id=1, news_repo=NewsRepository(None), cache=MemoryCache(max_size=16, ttl=60))
     assert isinstance(response, News)
+    update.assert_awaited_once_with(record_id=1, data={"is_deleted": True}, notify_event="delete")
 
     assert response.is_deleted is True
 
 
 @pytest.mark.asyncio
 async def test_delete_news_not_found(mocker):
-    mocker.patch.object(NewsRepository, 'find_one', return_value=None)
+    mocker.patch.object(NewsRepository, 'update_one_returning', return_value=None)
 
     with pytest.raises(HTTPException) as exc_info:
-        await delete_news(id=999)
+        await delete_news(id=999, news_repo=NewsRepository(None), cache=MemoryCache(max_size=16, ttl=60))
 
     assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
     assert exc_info.value.detail == "News with this ID does not exist or it has been deleted"
@@ -61,13 +87,14 @@ async def test_delete_news_not_found(mocker):
 @pytest.mark.asyncio
 async def test_get_news_successful(mocker, test_client):
     fake_news = [
-        News(id=1, title="Test News 1", date="2024-04-14T12:00:00", body="Body 1", is_deleted=False),
-        News(id=2, title="Test News 2", date="2024-04-15T12:00:00", body="Body 2", is_deleted=False)
+        News(id=1, title="Test News 1", date="2024-04-14T12:00:00", body="Body 1", is_deleted=False,
+             comments_count=1),
+        News(id=2, title="Test News 2", date="2024-04-15T12:00:00", body="Body 2", is_deleted=False,
+             comments_count=2)
     ]
 
-    mocker.patch.object(NewsRepository, 'find_all', return_value=fake_news)
-
-    mocker.patch.object(CommentsRepository, 'comments_count', new_callable=AsyncMock, side_effect=[1, 2])
+    mocker.patch.object(NewsRepository, 'find_page', return_value=(fake_news, None))
+    mocker.patch.object(NewsRepository, 'find_page_fingerprint', return_value=[(1, 1, 1), (2, 1, 2)])
 
     response = test_client.get("/news")
 
@@ -91,34 +118,587 @@ async def test_get_news_successful(mocker, test_client):
     assert response.json()["news"][1]["comments_count"] == 2
 
 
-@pytest.mark.asyncio
-async def test_get_news_by_id_successful(mocker, test_client):
-    fake_news = News(id=1, title="Test News 1", date="2024-04-14T12:00:00", body="Body 1", is_deleted=False)
+# the document as Postgres writes json_build_object: its own spacing, the field order of GetNewsCommentsModel
+NEWS_DOCUMENT = ('{"title" : "Test News 1", "date" : "2024-04-14T12:00:00Z", "body" : "Body 1", '
+                 '"is_deleted" : false, "id" : 1, "comments_count" : 1, "comments" : '
+                 '[{"news_id" : 1, "title" : "Comment 1", "date" : "2024-04-14T12:00:00.500000Z", '
+                 '"comment" : "Comment 1", "id" : 1}]}')
+DocumentRow = namedtuple("DocumentRow", "document fetched last_date last_id")
 
-    fake_comments = [
-        Comments(id=1, news_id=1, title="Comment 1", date="2024-04-14T12:00:00", comment="Comment 1")
-    ]
 
-    mocker.patch.object(NewsRepository, 'get_one', return_value=fake_news)
+def document_session(row):
+    result = MagicMock()
+    result.one_or_none.return_value = row
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=result)
+    return session
 
-    mocker.patch.object(CommentsRepository, 'comments_count', return_value=1)
 
-    mocker.patch.object(CommentsRepository, 'find_all', return_value=fake_comments)
+@pytest.mark.asyncio
+async def test_get_news_by_id_successful(mocker, test_client):
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 1, False))
+    find_document = mocker.patch.object(NewsRepository, 'find_document',
+                                        return_value=NEWS_DOCUMENT[:-1].encode() + b',"next_cursor":null}')
 
     response = test_client.get("/news/1")
 
     assert response.status_code == status.HTTP_200_OK
+    assert GetNewsCommentsModel.model_validate_json(response.content)
 
     assert response.json()["id"] == 1
     assert response.json()["title"] == "Test News 1"
-    assert response.json()["date"] == "2024-04-14T12:00:00"
+    assert response.json()["date"] == "2024-04-14T12:00:00Z"
     assert response.json()["body"] == "Body 1"
     assert response.json()["is_deleted"] == False
     assert len(response.json()["comments"]) == 1
     assert response.json()["comments_count"] == 1
+    assert response.json()["next_cursor"] is None
 
     assert response.json()["comments"][0]["id"] == 1
     assert response.json()["comments"][0]["news_id"] == 1
     assert response.json()["comments"][0]["title"] == "Comment 1"
-    assert response.json()["comments"][0]["date"] == "2024-04-14T12:00:00"
+    assert response.json()["comments"][0]["date"] == "2024-04-14T12:00:00.500000Z"
     assert response.json()["comments"][0]["comment"] == "Comment 1"
+    find_document.assert_awaited_once_with(record_id=1, limit=50, after=None)
+
+
+@pytest.mark.asyncio
+async def test_find_document_matches_response_model():
+    date = datetime(2024, 4, 14, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    session = document_session(DocumentRow(NEWS_DOCUMENT, 2, date, 1))
+
+    content = await NewsRepository(session).find_document(1, limit=1)
+
+    document = json.loads(content)
+    assert list(document) == list(GetNewsCommentsModel.model_fields)
+    assert list(document["comments"][0]) == list(GetCommentModel.model_fields)
+    assert decode_cursor(document["next_cursor"]) == (date, 1)
+    # the database renders datetimes exactly as the ORM path does
+    assert document["date"] == json.loads(dump_json(datetime(2024, 4, 14, 12, tzinfo=timezone.utc)))
+    assert document["comments"][0]["date"] == json.loads(dump_json(date))
+    assert GetNewsCommentsModel.model_validate_json(content).comments[0].date == date
+
+
+@pytest.mark.asyncio
+async def test_find_document_statement_keys():
+    session = document_session(None)
+
+    assert await NewsRepository(session).find_document(1) is None
+
+    statement = str(session.execute.call_args.args[0])
+    news_keys = [f"'{field}'" for field in (*NEWS_FIELDS, "comments")]
+    comment_keys = [f"'{field}'" for field in GetCommentModel.model_fields]
+    positions = [statement.index(key) for key in news_keys[:-1]]
+    assert positions == sorted(positions)
+    assert all(key in statement for key in comment_keys)
+
+
+@pytest.mark.asyncio
+async def test_get_news_by_id_uses_one_session(mocker, test_client):
+    session = document_session(DocumentRow(NEWS_DOCUMENT, 1, None, None))
+    fingerprint = MagicMock()
+    fingerprint.one_or_none.return_value = Fingerprint(1, 1, 1, False)
+    session.execute.side_effect = [fingerprint, session.execute.return_value]
+    opened_sessions = []
+
+    async def fake_session():
+        opened_sessions.append(session)
+        yield session
+
+    app.dependency_overrides[get_read_session] = fake_session
+    try:
+        response = test_client.get("/news/1")
+    finally:
+        app.dependency_overrides.pop(get_read_session)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["comments_count"] == 1
+    assert len(response.json()["comments"]) == 1
+    assert len(opened_sessions) == 1
+    # the ETag pre-check is the only statement besides the document itself
+    assert session.execute.await_count == 2
+
+
+@requires_database
+def test_get_news_by_id_checks_out_one_connection(test_client):
+    news = {"title": "Pool", "date": "2999-01-01T00:00:00Z", "body": "One connection per request"}
+    assert test_client.post("/news", json=news).status_code == status.HTTP_200_OK
+    news_id = test_client.get("/news", params={"limit": 1}).json()["news"][0]["id"]
+    pool = app.state.database.engine.pool
+    checkouts = pool.checkouts
+
+    response = test_client.get(f"/news/{news_id}")
+
+    assert response.status_code == status.HTTP_200_OK
+    # the ETag pre-check and the document share the connection of the request's one session
+    assert pool.checkouts - checkouts == 1
+    test_client.delete("/news", params={"id": news_id})
+
+
+@pytest.mark.asyncio
+async def test_get_news_next_cursor(mocker, test_client):
+    date = datetime(2024, 4, 15, 12, 0, tzinfo=timezone.utc)
+    fake_news = [
+        News(id=2, title="Test News 2", date=date, body="Body 2", is_deleted=False, comments_count=0),
+        News(id=1, title="Test News 1", date=date, body="Body 1", is_deleted=False, comments_count=0)
+    ]
+    page = NewsRepository.split_page(fake_news, limit=1)
+
+    find_page = mocker.patch.object(NewsRepository, 'find_page', return_value=page)
+    mocker.patch.object(NewsRepository, 'find_page_fingerprint', return_value=[(2, 1, 0), (1, 1, 0)])
+
+    response = test_client.get("/news", params={"limit": 1})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["news_count"] == 1
+    assert response.json()["news"][0]["id"] == 2
+    assert decode_cursor(response.json()["next_cursor"]) == (date, 2)
+
+    test_client.get("/news", params={"limit": 1, "after": response.json()["next_cursor"]})
+    assert find_page.call_args.kwargs["after"] == (date, 2)
+
+
+def test_get_news_invalid_cursor(test_client):
+    response = test_client.get("/news", params={"after": "not a cursor"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_add_comment_news_not_found(mocker, test_client):
+    mocker.patch.object(NewsRepository, 'add_comment', return_value=None)
+
+    response = test_client.post("/comments", json={"news_id": 999, "title": "Comment", "comment": "Text",
+                                                   "date": "2024-04-14T12:00:00"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_news_cached_until_comment_added(mocker, test_client, fresh_cache):
+    fake_news = [News(id=1, title="Test News 1", date="2024-04-14T12:00:00", body="Body 1", is_deleted=False,
+                      comments_count=0)]
+    find_page = mocker.patch.object(NewsRepository, 'find_page', return_value=(fake_news, None))
+    mocker.patch.object(NewsRepository, 'find_page_fingerprint', return_value=[(1, 1, 0)])
+    mocker.patch.object(NewsRepository, 'add_comment', return_value=1)
+
+    assert test_client.get("/news").status_code == status.HTTP_200_OK
+    assert test_client.get("/news").status_code == status.HTTP_200_OK
+    assert find_page.call_count == 1
+    assert fresh_cache.stats()["hits"] == 1
+
+    test_client.post("/comments", json={"news_id": 1, "title": "Comment", "comment": "Text",
+                                        "date": "2024-04-14T12:00:00"})
+    test_client.get("/news")
+    assert find_page.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_lru_and_ttl():
+    cache = MemoryCache(max_size=2, ttl=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")
+    await cache.set("c", 3)
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+
+    cache.ttl = -1
+    await cache.set("d", 4)
+    assert await cache.get("d") is None
+
+
+@pytest.mark.asyncio
+async def test_get_news_by_id_not_modified(mocker, test_client):
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 0, False))
+    find_document = mocker.patch.object(NewsRepository, 'find_document', return_value=b'{"id":1}')
+
+    response = test_client.get("/news/1")
+    etag = response.headers["ETag"]
+
+    response = test_client.get("/news/1", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    assert find_document.call_count == 1
+
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 2, 0, False))
+    response = test_client.get("/news/1", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_delete_news_many(mocker, test_client):
+    soft_delete_many = mocker.patch.object(NewsRepository, 'soft_delete_many', return_value=[1, 3])
+
+    response = test_client.post("/news/bulk/delete", json={"ids": [1, 2, 3]})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"changed": [1, 3], "unchanged": [2]}
+    soft_delete_many.assert_awaited_once_with([1, 2, 3], deleted=True, notify_event="delete")
+
+
+@pytest.mark.asyncio
+async def test_get_news_query_count(mocker, test_client):
+    connection = MagicMock(info={})
+
+    async def fake_query(*args, **kwargs):
+        before_cursor_execute(connection, None, "SELECT 1", {}, None, False)
+        after_cursor_execute(connection, None, "SELECT 1", {}, None, False)
+        return [(1, 1, 0)]
+
+    mocker.patch.object(NewsRepository, 'find_page_fingerprint', side_effect=fake_query)
+    mocker.patch.object(NewsRepository, 'find_page', return_value=([], None))
+
+    response = test_client.get("/news")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert query_count(response) == 1
+    assert_max_queries(response, 2)
+
+
+def stream_with_queries(comments, delay=0.0, seen_in_flight=None):
+    connection = MagicMock(info={})
+
+    async def fake_stream(*args, **kwargs):
+        for comment in comments:
+            # a statement run while the body is being sent, as a server-side cursor fetch is
+            before_cursor_execute(connection, None, "FETCH FORWARD 1000", {}, None, False)
+            after_cursor_execute(connection, None, "FETCH FORWARD 1000", {}, None, False)
+            if seen_in_flight is not None:
+                seen_in_flight.append(metrics.REQUESTS_IN_FLIGHT._value.get())
+            await asyncio.sleep(delay)
+            yield comment
+
+    return fake_stream
+
+
+def test_streamed_queries_are_counted(mocker, test_client, caplog):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    comments = [Comments(id=i, news_id=1, title="Comment", date=date, comment="Text") for i in (1, 2, 3)]
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 3, False))
+    mocker.patch.object(CommentsRepository, 'stream_all', side_effect=stream_with_queries(comments))
+
+    with caplog.at_level(logging.INFO, logger="app.requests"):
+        response = test_client.get("/news/1/comments")
+
+    assert response.status_code == status.HTTP_200_OK
+    [record] = [record for record in caplog.records if record.name == "app.requests"]
+    assert record.route == "/news/{id}/comments"
+    assert record.queries == 3
+
+
+def test_streamed_response_stays_in_flight(mocker, test_client):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    comments = [Comments(id=i, news_id=1, title="Comment", date=date, comment="Text") for i in (1, 2)]
+    seen_in_flight = []
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 2, False))
+    mocker.patch.object(CommentsRepository, 'stream_all',
+                        side_effect=stream_with_queries(comments, delay=0.05, seen_in_flight=seen_in_flight))
+    latency = metrics.REQUEST_LATENCY.labels(method="GET", route="/news/{id}/comments")
+    in_flight, latency_sum = metrics.REQUESTS_IN_FLIGHT._value.get(), latency._sum.get()
+
+    response = test_client.get("/news/1/comments")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert seen_in_flight == [in_flight + 1] * 2
+    assert metrics.REQUESTS_IN_FLIGHT._value.get() == in_flight
+    # the latency covers the whole stream, not only the time to the headers
+    assert latency._sum.get() - latency_sum >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_query_listeners_count_statements(caplog):
+    # a sync SQLite engine behind the AsyncEngine attribute the listeners are attached to
+    engine = SimpleNamespace(sync_engine=create_engine("sqlite://"))
+    install_query_listeners(engine, slow_query_ms=1e-6)
+    stats = RequestStats()
+    token = request_stats.set(stats)
+
+    def run_queries():
+        with engine.sync_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT :value"), {"value": 2})
+
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.slow_query"):
+            # the way AsyncSession runs statements, so the request context has to cross into the greenlet
+            await greenlet_spawn(run_queries)
+    finally:
+        request_stats.reset(token)
+
+    assert stats.queries == 2
+    assert stats.db_time > 0
+    assert [record.statement for record in caplog.records] == ["SELECT 1", "SELECT ?"]
+    assert caplog.records[1].parameters == "(2,)"
+
+
+def test_metrics(mocker, test_client):
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=None)
+    test_client.get("/news/1")
+
+    response = test_client.get("/metrics")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert 'http_request_duration_seconds_count{method="GET",route="/news/{id}"}' in response.text
+    assert 'db_pool_size{pool="primary"} 5.0' in response.text
+
+
+def test_fast_json_matches_pydantic_shape():
+    news = News(id=1, title="Test News 1", date=datetime(2024, 4, 14, 12, 0, 0, 123456, tzinfo=timezone.utc),
+                body="Body 1", is_deleted=False, comments_count=3, version=2)
+
+    expected = GetNewsModel.model_validate(news, from_attributes=True).model_dump_json()
+
+    assert json.loads(dump_json(row_dict(news, NEWS_FIELDS))) == json.loads(expected)
+
+
+@pytest.mark.asyncio
+async def test_stream_news_comments(mocker, test_client):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    first_page = [Comments(id=1, news_id=1, title="Comment 1", date=date, comment="Comment 1")]
+    second_page = [Comments(id=2, news_id=1, title="Comment 2", date=date, comment="Comment 2")]
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 2, False))
+
+    async def fake_stream(*args, **kwargs):
+        for comment in first_page + second_page:
+            yield comment
+
+    stream_all = mocker.patch.object(CommentsRepository, 'stream_all', side_effect=fake_stream)
+
+    response = test_client.get("/news/1/comments")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [comment["id"] for comment in response.json()] == [1, 2]
+    assert response.json()[0]["date"] == "2024-04-14T12:00:00Z"
+    assert stream_all.call_args.kwargs["conditions"] == {"news_id": 1}
+
+
+@pytest.mark.asyncio
+async def test_find_all_empty_is_list():
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = []
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=result)
+
+    assert await CommentsRepository(session).find_all(conditions={"news_id": 1}) == []
+
+
+ExportRow = namedtuple("ExportRow", "id title date body comments_count comment_id comment_title comment_date comment")
+
+
+@pytest.mark.asyncio
+async def test_export_news_ndjson(mocker, test_client):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    rows = [ExportRow(1, "News 1", date, "Body 1", 2, 1, "Comment 1", date, "Text 1"),
+            ExportRow(1, "News 1", date, "Body 1", 2, 2, "Comment 2", date, "Text 2"),
+            ExportRow(2, "News 2", date, "Body 2", 0, None, None, None, None)]
+
+    async def fake_stream(*args, **kwargs):
+        for row in rows:
+            yield row
+
+    stream = mocker.patch.object(NewsRepository, 'stream_with_comments', side_effect=fake_stream)
+
+    response = test_client.get("/news/export", params={"date_from": "2024-04-01T00:00:00Z"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-encoding"] == "gzip"
+    documents = [json.loads(line) for line in response.text.splitlines()]
+    assert [document["id"] for document in documents] == [1, 2]
+    assert [comment["id"] for comment in documents[0]["comments"]] == [1, 2]
+    assert documents[0]["comments"][0] == {"news_id": 1, "title": "Comment 1", "date": "2024-04-14T12:00:00Z",
+                                           "comment": "Text 1", "id": 1}
+    assert documents[1]["comments"] == []
+    assert stream.call_args.kwargs["date_from"] == datetime(2024, 4, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_export_news_csv(mocker, test_client):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+
+    async def fake_stream(*args, **kwargs):
+        yield ExportRow(1, "News, 1", date, "Body 1", 1, 1, "Comment 1", date, "Text 1")
+
+    mocker.patch.object(NewsRepository, 'stream_with_comments', side_effect=fake_stream)
+
+    response = test_client.get("/news/export", params={"format": "csv"}, headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert "content-encoding" not in response.headers
+    assert response.text.splitlines() == [
+        "id,title,date,body,comments_count,comment_id,comment_title,comment_date,comment",
+        '1,"News, 1",2024-04-14T12:00:00+00:00,Body 1,1,1,Comment 1,2024-04-14T12:00:00+00:00,Text 1',
+    ]
+
+
+SearchRow = namedtuple("SearchRow", "id title date comments_count rank title_highlight snippet")
+
+
+@pytest.mark.asyncio
+async def test_search_news(mocker, test_client):
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    rows = [SearchRow(2, "Big news", date, 3, 0.25, "<b>Big</b> news", "Something <b>big</b> happened")]
+    search = mocker.patch.object(NewsRepository, 'search', return_value=(rows, encode_rank_cursor(0.25, 2)))
+
+    response = test_client.get("/news/search", params={"q": "big", "comments": True, "limit": 1,
+                                                       "after": encode_rank_cursor(0.5, 7)})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["results"][0]["snippet"] == "Something <b>big</b> happened"
+    assert decode_rank_cursor(response.json()["next_cursor"]) == (0.25, 2)
+    assert search.call_args.args == ("big",)
+    assert search.call_args.kwargs == {"with_comments": True, "limit": 1, "after": (0.5, 7)}
+
+
+SCRIPT_BODY = '<script>alert("big")</script> Something big happened'
+
+
+def test_search_headline_escapes_html():
+    compiled = headline(literal(SCRIPT_BODY, Text), search_query("big")).compile(dialect=postgresql.asyncpg.dialect())
+    params = [compiled.params[key] for key in compiled.positiontup]
+
+    # ts_headline gets the body through the replace() chain, applied here innermost first
+    assert str(compiled).startswith("ts_headline($1::REGCONFIG, replace(replace(replace(replace(replace($2")
+    text_seen = params[1]
+    for char, entity in zip(params[2:12:2], params[3:12:2]):
+        text_seen = text_seen.replace(char, entity)
+    assert text_seen == "&lt;script&gt;alert(&quot;big&quot;)&lt;/script&gt; Something big happened"
+
+
+@requires_database
+@pytest.mark.asyncio
+async def test_search_headline_escapes_html_in_postgres():
+    database = make_test_database()
+    try:
+        async with database.session_maker() as session:
+            snippet = await session.scalar(select(headline(literal(SCRIPT_BODY, Text), search_query("big"))))
+    finally:
+        await database.dispose()
+
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet
+    assert "<b>big</b>" in snippet
+
+
+def test_search_news_requires_query(test_client):
+    assert test_client.get("/news/search", params={"q": ""}).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert test_client.get("/news/search", params={"q": "big", "after": "not a cursor"}).status_code == \
+        status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_news_events_fan_out_and_resync(mocker):
+    mocker.patch.object(NewsEvents, 'listen')
+    events = NewsEvents("postgresql://localhost/news", queue_size=2)
+    first, second, other = await events.subscribe(1), await events.subscribe(1), await events.subscribe(2)
+
+    for comment_id in (1, 2, 3):
+        events._on_notify(None, 0, "news_events", json.dumps({"event": "comment", "news_id": 1,
+                                                               "comment_id": comment_id}))
+
+    # the queue overflowed on the third event, the subscriber is told to refetch instead
+    assert await first.get(timeout=0.1) == RESYNC_EVENT
+    assert await first.get(timeout=0.01) is None
+    assert first.dropped == 2
+    assert await other.get(timeout=0.01) is None
+
+    first.close()
+    second.close()
+    assert events.subscriber_count() == 1
+    assert 1 not in events.subscribers
+
+
+@pytest.mark.asyncio
+async def test_mutations_notify_in_the_same_statement():
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=MagicMock())
+    news_repo = NewsRepository(session)
+
+    await news_repo.update_one_returning(record_id=1, data={"is_deleted": True}, notify_event="delete")
+    await news_repo.soft_delete_many([1, 3], deleted=False, notify_event="restore")
+
+    assert session.execute.await_count == 2
+    for call in session.execute.await_args_list:
+        sql = str(call.args[0])
+        assert sql.startswith("WITH") and "UPDATE" in sql and "pg_notify" in sql
+
+
+@pytest.mark.asyncio
+async def test_news_events_stream(mocker):
+    mocker.patch.object(NewsEvents, 'listen')
+    events = NewsEvents("postgresql://localhost/news", heartbeat_seconds=0.01)
+    news_repo = NewsRepository(AsyncMock())
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 0, False))
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=False)
+
+    response = await news_events(id=1, request=request, news_repo=news_repo, events=events)
+    news_repo.session.close.assert_awaited_once()
+    assert response.media_type == "text/event-stream"
+    # nothing is subscribed until the body is sent, a response that never is leaves nothing behind
+    assert events.subscriber_count() == 0
+
+    body = response.body_iterator
+    assert await anext(body) == SSE_HEARTBEAT
+    events.dispatch({"event": "comment", "news_id": 1, "comment_id": 5})
+    message = await anext(body)
+    assert message == b'event: comment\ndata: {"event": "comment", "news_id": 1, "comment_id": 5}\n\n'
+    await body.aclose()
+    assert events.subscriber_count() == 0
+
+
+@requires_database
+@pytest.mark.asyncio
+async def test_committed_comment_reaches_sse_stream():
+    database = make_test_database()
+    events = NewsEvents(listen_dsn(database.engine), heartbeat_seconds=0.5)
+    date = datetime(2024, 4, 14, 12, 0, tzinfo=timezone.utc)
+    request = MagicMock()
+    request.is_disconnected = AsyncMock(return_value=False)
+    try:
+        async with database.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with database.session_maker() as session:
+            news_id = await NewsRepository(session).add_one({"title": "Live", "date": date, "body": "Live body"})
+            await session.commit()
+
+        async with database.read_session_maker() as session:
+            response = await news_events(id=news_id, request=request, news_repo=NewsRepository(session),
+                                         events=events)
+        body = response.body_iterator
+        # the first heartbeat means the stream has subscribed
+        assert await anext(body) == SSE_HEARTBEAT
+
+        comment = {"news_id": news_id, "title": "Comment", "date": date, "comment": "Text"}
+        async with database.session_maker() as session:
+            await NewsRepository(session).add_comment(comment)
+            await session.rollback()
+        assert await anext(body) == SSE_HEARTBEAT
+
+        async with database.session_maker() as session:
+            comment_id = await NewsRepository(session).add_comment(comment)
+            await session.commit()
+        message = await anext(body)
+        await body.aclose()
+
+        assert message.startswith(b"event: comment\n")
+        assert json.loads(message.split(b"data: ", 1)[1]) == {"event": "comment", "news_id": news_id,
+                                                               "comment_id": comment_id}
+        assert events.subscriber_count() == 0
+    finally:
+        await events.close()
+        await database.dispose()
+
+
+@pytest.mark.asyncio
+async def test_news_events_not_found(mocker):
+    mocker.patch.object(NewsRepository, 'find_fingerprint', return_value=Fingerprint(1, 1, 0, True))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await news_events(id=1, request=MagicMock(), news_repo=NewsRepository(AsyncMock()),
+                          events=NewsEvents("postgresql://localhost/news"))
+
+    assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
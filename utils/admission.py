@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+from utils import metrics
+
+CHEAP = "cheap"
+BULK = "bulk"
+SHARED = "shared"
+
+
+class Shed(Exception):
+    """
+    The request was turned away rather than queued; reason is its metrics label
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    """
+    At most limit holders at a time and at most queue_size waiters, each waiting no longer than timeout seconds.
+    Cheap waiters are let in before bulk ones, and a cheap request finding the queue full takes the place of the
+    newest bulk waiter
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiters: dict[str, deque[asyncio.Future]] = {CHEAP: deque(), BULK: deque()}
+
+    def queued(self) -> int:
+        return len(self.waiters[CHEAP]) + len(self.waiters[BULK])
+
+    async def acquire(self, priority: str = CHEAP):
+        if self.in_flight < self.limit and not self.queued():
+            self.in_flight += 1
+            return
+        if self.queued() >= self.queue_size and not self.evict(priority):
+            raise Shed("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[priority].append(waiter)
+        queue_depth = metrics.ADMISSION_QUEUE_DEPTH.labels(limiter=self.name, priority=priority)
+        queue_depth.inc()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            raise Shed("timeout") from None
+        except asyncio.CancelledError:
+            # the slot may have been handed over just as the client went away
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release()
+            raise
+        finally:
+            queue_depth.dec()
+            if waiter in self.waiters[priority]:
+                self.waiters[priority].remove(waiter)
+
+    def evict(self, priority: str) -> bool:
+        """
+        Make room for a cheap waiter by shedding the newest bulk one; a waiter that timed out or was cancelled
+        but has not woken up to leave the queue yet is dropped on the way
+        """
+        if priority == BULK:
+            return False
+        waiters = self.waiters[BULK]
+        while waiters:
+            waiter = waiters.pop()
+            if not waiter.done():
+                waiter.set_exception(Shed("evicted"))
+                return True
+        return self.queued() < self.queue_size
+
+    def release(self):
+        """
+        Hand the slot over to the first waiter, cheap ones first, or free it
+        """
+        for priority in (CHEAP, BULK):
+            waiters = self.waiters[priority]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight,
+                "queued": {priority: len(waiters) for priority, waiters in self.waiters.items()}}
+
+
+class AdmissionControl:
+    """
+    A limiter shared by all the admitted routes, sized to the connection pool, plus tighter limiters of single
+    routes; routes are keyed as "METHOD /route/{template}"
+    """
+
+    def __init__(self, limit: int, queue_size: int = 50, timeout: float = 1.0, retry_after: int = 1,
+                 route_limits: dict[str, int] = None, bulk_routes=(), excluded_routes=()):
+        self.limiter = ConcurrencyLimiter(SHARED, limit, queue_size, timeout)
+        self.route_limiters = {route: ConcurrencyLimiter(route, route_limit, queue_size, timeout)
+                               for route, route_limit in (route_limits or {}).items()}
+        self.retry_after = retry_after
+        self.bulk_routes = frozenset(bulk_routes)
+        self.excluded_routes = frozenset(excluded_routes)
+
+    @classmethod
+    def from_settings(cls, settings) -> "AdmissionControl":
+        return cls(settings.ADMISSION_LIMIT or settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+                   queue_size=settings.ADMISSION_QUEUE_SIZE,
+                   timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+                   retry_after=settings.ADMISSION_RETRY_AFTER,
+                   route_limits=settings.ADMISSION_ROUTE_LIMITS,
+                   bulk_routes=settings.ADMISSION_BULK_ROUTES,
+                   excluded_routes=settings.ADMISSION_EXCLUDED_ROUTES)
+
+    @asynccontextmanager
+    async def admit(self, route: str):
+        """
+        Hold a slot of the route's own limiter, if any, and then of the shared one; raises Shed when turned away
+        """
+        priority = BULK if route in self.bulk_routes else CHEAP
+        async with AsyncExitStack() as stack:
+            for limiter in (self.route_limiters.get(route), self.limiter):
+                if limiter:
+                    await limiter.acquire(priority)
+                    stack.callback(limiter.release)
+            yield
+
+    def stats(self) -> dict:
+        return {limiter.name: limiter.stats() for limiter in (self.limiter, *self.route_limiters.values())}
+
+
+def match_route(scope) -> str | None:
+    """
+    "METHOD /route/{template}" of the route the request will be routed to, None when there is none
+    """
+    for route in scope["app"].router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            scope["route"] = child_scope.get("route", route)
+            return f"{scope['method']} {route.path}"
+    return None
+
+
+class AdmissionMiddleware:
+    """
+    Admission control by the AdmissionControl in app.state.admission; without one every request passes.
+    Plain ASGI rather than @app.middleware("http"), so that a streamed response keeps its slot until the last
+    chunk is sent
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        admission = getattr(scope["app"].state, "admission", None) if scope["type"] == "http" else None
+        route = match_route(scope) if admission else None
+        if route is None or route in admission.excluded_routes:
+            await self.app(scope, receive, send)
+            return
+        try:
+            async with admission.admit(route):
+                await self.app(scope, receive, send)
+        except Shed as e:
+            metrics.REQUESTS_SHED.labels(method=scope["method"], route=scope["route"].path, reason=e.reason).inc()
+            response = JSONResponse({"detail": "The server is busy, retry later"},
+                                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    headers={"Retry-After": str(admission.retry_after)})
+            await response(scope, receive, send)
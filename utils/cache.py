@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from config import get_settings
+from utils.metrics import CACHE_REQUESTS
+
+
+class CacheBackend:
+    """
+    Interface of a read cache; a Redis-compatible store can implement it with GET/SETEX/DEL and SCAN MATCH
+    """
+    hits: int = 0
+    misses: int = 0
+
+    async def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    async def invalidate(self, *prefixes: str) -> None:
+        raise NotImplementedError
+
+    async def get_or_set(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await self.get(key)
+        if value is None:
+            value = await loader()
+            if value is not None:
+                await self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0}
+
+
+class MemoryCache(CacheBackend):
+    """
+    Per-process LRU cache with a TTL; other workers only see a write once their copy expires
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: str = "news"):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            CACHE_REQUESTS.labels(cache=self.name, result="miss").inc()
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        CACHE_REQUESTS.labels(cache=self.name, result="hit").inc()
+        return item[1]
+
+    async def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    async def invalidate(self, *prefixes: str) -> None:
+        for key in [key for key in self._data if key.startswith(prefixes)]:
+            del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+news_cache: MemoryCache | None = None
+
+
+def get_cache() -> CacheBackend:
+    global news_cache
+    if news_cache is None:
+        settings = get_settings()
+        news_cache = MemoryCache(max_size=settings.CACHE_MAX_SIZE, ttl=settings.CACHE_TTL)
+    return news_cache
+
+
+def news_list_key(etag: str) -> str:
+    """
+    Keyed by the page ETag, so a cached page is never served under a newer tag
+    """
+    return f"news:list:{etag}"
+
+
+def news_item_key(news_id: int, etag: str) -> str:
+    return f"news:{news_id}:{etag}"
+
+
+def news_keys(news_id: int | None = None) -> tuple[str, ...]:
+    """
+    Prefixes to invalidate after a write: every feed page, plus every page of the given news item
+    """
+    if news_id is None:
+        return "news:list:",
+    return "news:list:", f"news:{news_id}:"
@@ -0,0 +1,143 @@
+import contextvars
+import logging
+import time
+import uuid
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+
+from utils import metrics
+from utils.log import request_id
+
+logger = logging.getLogger("app.requests")
+slow_query_logger = logging.getLogger("app.slow_query")
+
+MAX_LOGGED_PARAMETERS = 1000
+
+
+class RequestStats:
+    """
+    Database work done on behalf of one request
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+    def server_timing(self, total: float) -> str:
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", '
+                f'db-pool;dur={self.pool_wait * 1000:.2f}, '
+                f'total;dur={total * 1000:.2f}')
+
+
+request_stats: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany, slow_query_ms: float = 0.0):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = request_stats.get()
+    if stats:
+        stats.queries += 1
+        stats.db_time += elapsed
+    if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+        slow_query_logger.warning("Slow query took %.1f ms", elapsed * 1000, extra={
+            "duration_ms": round(elapsed * 1000, 2),
+            "statement": statement,
+            "parameters": repr(parameters)[:MAX_LOGGED_PARAMETERS],
+        })
+
+
+def handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def install_query_listeners(engine: AsyncEngine, slow_query_ms: float = 0.0):
+    """
+    Count and time the statements of the engine; those slower than slow_query_ms are logged, 0 disables that
+    """
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        after_cursor_execute(conn, cursor, statement, parameters, context, executemany, slow_query_ms)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
+
+
+def record_pool_wait(seconds: float, timed_out=False):
+    metrics.POOL_WAIT.observe(seconds)
+    if timed_out:
+        metrics.POOL_TIMEOUTS.inc()
+    stats = request_stats.get()
+    if stats:
+        stats.pool_wait += seconds
+
+
+class InstrumentationMiddleware:
+    """
+    Count the queries, database time and pool wait of a request and report them in Server-Timing, the log and
+    the Prometheus metrics. Plain ASGI rather than @app.middleware("http"), so that the log and the metrics
+    cover a streamed body until its last chunk; Server-Timing goes out with the headers and covers the work
+    done before them
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        stats = RequestStats()
+        stats_token = request_stats.set(stats)
+        id_token = request_id.set(request.headers.get("x-request-id") or uuid.uuid4().hex)
+        start = time.perf_counter()
+        # a request that fails before its response starts is answered with 500 by ServerErrorMiddleware
+        status_code = 500
+
+        async def send_instrumented(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["Server-Timing"] = stats.server_timing(time.perf_counter() - start)
+                headers["X-Request-ID"] = request_id.get()
+            await send(message)
+
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_instrumented)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            try:
+                self.record(request, stats, status_code, time.perf_counter() - start)
+            finally:
+                request_stats.reset(stats_token)
+                request_id.reset(id_token)
+
+    @staticmethod
+    def record(request: Request, stats: RequestStats, status_code: int, total: float):
+        route = metrics.route_label(request)
+        metrics.REQUEST_LATENCY.labels(method=request.method, route=route).observe(total)
+        metrics.REQUESTS.labels(method=request.method, route=route, status=status_code).inc()
+        metrics.REQUEST_QUERIES.labels(method=request.method, route=route).observe(stats.queries)
+        metrics.update_pool_metrics()
+        logger.info("%s %s %s", request.method, request.url.path, status_code, extra={
+            "method": request.method,
+            "path": request.url.path,
+            "route": route,
+            "status": status_code,
+            "duration_ms": round(total * 1000, 2),
+            "queries": stats.queries,
+            "db_time_ms": round(stats.db_time * 1000, 2),
+            "pool_wait_ms": round(stats.pool_wait * 1000, 2),
+        })
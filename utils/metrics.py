@@ -0,0 +1,63 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest, multiprocess
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route",
+                            ["method", "route"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter("http_requests_total", "Requests by route and status", ["method", "route", "status"])
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served", multiprocess_mode="livesum")
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements per request", ["method", "route"],
+                            buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+
+POOL_SIZE = Gauge("db_pool_size", "Configured pool size", ["pool"], multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use", ["pool"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections opened beyond the pool size", ["pool"],
+                      multiprocess_mode="livesum")
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pool connection",
+                      buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that timed out waiting for a connection")
+
+ADMISSION_QUEUE_DEPTH = Gauge("http_admission_queue_depth", "Requests waiting for an admission slot",
+                              ["limiter", "priority"], multiprocess_mode="livesum")
+REQUESTS_SHED = Counter("http_requests_shed_total", "Requests turned away by admission control with 503",
+                        ["method", "route", "reason"])
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ["cache", "result"])
+
+watched_pools: dict[str, AsyncEngine] = {}
+
+
+def watch_pool(name: str, engine: AsyncEngine):
+    watched_pools[name] = engine
+
+
+def update_pool_metrics():
+    for name, engine in watched_pools.items():
+        pool = engine.pool
+        POOL_SIZE.labels(pool=name).set(pool.size())
+        POOL_CHECKED_OUT.labels(pool=name).set(pool.checkedout())
+        POOL_OVERFLOW.labels(pool=name).set(max(pool.overflow(), 0))
+
+
+def route_label(request) -> str:
+    """
+    The route template rather than the raw path, so ids do not explode the label cardinality
+    """
+    route = request.scope.get("route")
+    return route.path if route else "unmatched"
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Metrics of this process, or of every gunicorn worker when PROMETHEUS_MULTIPROC_DIR is set
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
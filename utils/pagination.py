@@ -0,0 +1,60 @@
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException, Query, status
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def encode_cursor(date: datetime, record_id: int) -> str:
+    raw = f"{date.isoformat()}|{record_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, record_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date), int(record_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def encode_rank_cursor(rank: float, record_id: int) -> str:
+    raw = f"{rank!r}|{record_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        rank, record_id = raw.rsplit("|", 1)
+        return float(rank), int(record_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+class Pagination:
+    """
+    Keyset pagination parameters: page size and an opaque (date, id) cursor
+    """
+    decode = staticmethod(decode_cursor)
+
+    def __init__(self,
+                 limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+                 after: str | None = Query(None, description="Cursor returned as next_cursor by the previous page")):
+        self.limit = limit
+        self.after = None
+        if after:
+            try:
+                self.after = self.decode(after)
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+class RankPagination(Pagination):
+    """
+    Keyset pagination over ranked search results: an opaque (rank, id) cursor
+    """
+    decode = staticmethod(decode_rank_cursor)
@@ -2,11 +2,14 @@ import random
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy import insert, select, update, or_, and_
+from sqlalchemy import insert, select, update, or_, and_, tuple_, any_, bindparam, inspect
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import async_session_maker, Base, get_async_session
+from database import Base, get_async_session, get_read_session
+from utils.pagination import encode_cursor
 
 
 class SQLAlchemyRepository:
@@ -16,12 +19,58 @@ class SQLAlchemyRepository:
     def __init__(self, session: Annotated[AsyncSession, Depends(get_async_session)]):
         self.session = session
 
-    async def add_one(self, data: dict):
+    @classmethod
+    def reader(cls, session: Annotated[AsyncSession, Depends(get_read_session)]):
+        """
+        Dependency for read-only routes, bound to the replica session when one is configured
+        """
+        return cls(session)
+
+    async def commit(self):
+        await self.session.commit()
+
+    def update_values(self) -> dict:
+        """
+        Extra SET values applied by every update, e.g. a version counter
+        """
+        return {}
+
+    def event_notification(self, event: str, record_id):
+        """
+        Expression that notifies listeners of an event of the row, selected in the statement making the change
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not publish events")
+
+    def loaded_columns(self) -> list:
+        """
+        Columns an ordinary load of the model fetches, i.e. all but the deferred ones
+        """
+        return [column for attribute in inspect(self.model).column_attrs if not attribute.deferred
+                for column in attribute.columns]
+
+    def ids_param(self, record_ids):
+        return bindparam("ids", list(record_ids), type_=ARRAY(self.model.id.type))
+
+    async def add_one(self, data: dict, commit=False):
         stmt = insert(self.model).values(**data).returning(self.model.id)
         result = await self.session.execute(stmt)
-        await self.session.commit()
+        if commit:
+            await self.session.commit()
         return result.scalar_one()
 
+    async def add_many(self, data: list[dict], commit=False):
+        """
+        Insert several rows with one executemany and return their ids in input order
+        """
+        if not data:
+            return []
+        stmt = insert(self.model).returning(self.model.id, sort_by_parameter_order=True)
+        result = await self.session.execute(stmt, data)
+        ids = result.scalars().all()
+        if commit:
+            await self.session.commit()
+        return ids
+
     async def find_one(self, record_id: int):
         query = select(self.model).where(self.model.id == record_id)
         result = await self.session.execute(query)
@@ -30,12 +79,51 @@ class SQLAlchemyRepository:
         except NoResultFound:
             return None
 
-    async def update_one(self, record_id: int, data: dict):
-        stmt = update(self.model).where(self.model.id == record_id).values(data)
+    async def update_one(self, record_id: int, data: dict, commit=False):
+        stmt = update(self.model).where(self.model.id == record_id).values({**data, **self.update_values()})
         result = await self.session.execute(stmt)
-        await self.session.commit()
+        if commit:
+            await self.session.commit()
         return result.rowcount
 
+    async def update_one_returning(self, record_id: int, data: dict, commit=False, notify_event: str = None):
+        """
+        Update a row and return it in the same round-trip; None means there was no such row.
+        With notify_event the same statement also publishes that event of the updated row
+        """
+        stmt = (update(self.model)
+                .where(self.model.id == record_id)
+                .values({**data, **self.update_values()}))
+        if notify_event:
+            updated = stmt.returning(*self.loaded_columns()).cte("updated")
+            stmt = select(aliased(self.model, updated), self.event_notification(notify_event, updated.c.id))
+        else:
+            stmt = stmt.returning(self.model)
+        result = await self.session.execute(stmt)
+        record = result.scalar_one_or_none()
+        if commit:
+            await self.session.commit()
+        return record
+
+    async def soft_delete_many(self, record_ids, deleted=True, commit=False, notify_event: str = None):
+        """
+        Set is_deleted on several rows at once (deleted=False restores them); returns the ids that changed.
+        With notify_event the same statement also publishes that event of every changed row
+        """
+        stmt = (update(self.model)
+                .where(self.model.id == any_(self.ids_param(record_ids)))
+                .where(self.model.is_deleted != deleted)
+                .values({"is_deleted": deleted, **self.update_values()})
+                .returning(self.model.id))
+        if notify_event:
+            changed = stmt.cte("changed")
+            stmt = select(changed.c.id, self.event_notification(notify_event, changed.c.id))
+        result = await self.session.execute(stmt)
+        ids = result.scalars().all()
+        if commit:
+            await self.session.commit()
+        return ids
+
     async def find_all(self, conditions: dict = None, OR=False, AND=False):
         query = select(self.model)
 
@@ -57,11 +145,17 @@ class SQLAlchemyRepository:
                     query = query.where(getattr(self.model, key) == value)
 
         execute_result = await self.session.execute(query)
-        data = execute_result.scalars().all()
-        if not data:
-            return None
+        return execute_result.scalars().all()
 
-        return data
+    async def stream_all(self, conditions: dict = None, order_by: tuple = ("date", "id"), yield_per: int = 1000):
+        """
+        Iterate over matching rows through a server-side cursor, fetching yield_per rows at a time
+        """
+        query = self.where_conditions(select(self.model), conditions)
+        query = query.order_by(*(getattr(self.model, key) for key in order_by))
+        result = await self.session.stream(query.execution_options(yield_per=yield_per))
+        async for row in result.scalars():
+            yield row
 
     async def get_one(self, record_id: int):
         try:
@@ -69,4 +163,41 @@ class SQLAlchemyRepository:
             result = await self.session.execute(query)
             return result.scalar_one()
         except NoResultFound:
-            return False
+            return None
+
+    def where_conditions(self, query, conditions: dict = None):
+        if conditions:
+            for key, value in conditions.items():
+                query = query.where(getattr(self.model, key) == value)
+        return query
+
+    async def find_page(self, conditions: dict = None, limit: int = 50, after: tuple = None, descending=False):
+        query = self.where_conditions(select(self.model), conditions)
+        query = self.paginate(query, limit=limit, after=after, descending=descending)
+
+        execute_result = await self.session.execute(query)
+        return self.split_page(execute_result.scalars().all(), limit=limit)
+
+    def paginate(self, query, limit: int, after: tuple = None, descending=False):
+        """
+        Apply keyset pagination on (date, id) to a query selecting from the model
+        """
+        key = tuple_(self.model.date, self.model.id)
+        if after:
+            query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+        if descending:
+            query = query.order_by(self.model.date.desc(), self.model.id.desc())
+        else:
+            query = query.order_by(self.model.date, self.model.id)
+        return query.limit(limit + 1)
+
+    @staticmethod
+    def split_page(rows, limit: int):
+        """
+        Cut the look-ahead row off a page fetched by paginate and build the cursor of the next page
+        """
+        rows = list(rows)
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].date, rows[-1].id)
@@ -0,0 +1,103 @@
+import csv
+import io
+import zlib
+from typing import AsyncIterable, Iterable
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# "Z" for UTC, the same as Pydantic renders aware datetimes
+JSON_OPTIONS = orjson.OPT_UTC_Z
+STREAM_CHUNK_SIZE = 64 * 1024
+# zlib window bits that produce a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def dump_json(content) -> bytes:
+    return orjson.dumps(content, option=JSON_OPTIONS)
+
+
+def row_dict(row, fields: Iterable[str]) -> dict:
+    """
+    Plain dict of an ORM row for a response, skipping Pydantic validation of data we just read from the database
+    """
+    return {field: getattr(row, field) for field in fields}
+
+
+class JSONBytesResponse(Response):
+    """
+    Response for content that is already serialized JSON
+    """
+    media_type = "application/json"
+
+
+async def json_array_chunks(rows: AsyncIterable[dict]):
+    buffer = bytearray(b"[")
+    first = True
+    async for row in rows:
+        if not first:
+            buffer += b","
+        buffer += dump_json(row)
+        first = False
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+
+def streaming_json_array(rows: AsyncIterable[dict], headers: dict | None = None) -> StreamingResponse:
+    """
+    JSON array written row by row as the rows are fetched, so large lists are never held in memory
+    """
+    return StreamingResponse(json_array_chunks(rows), media_type="application/json", headers=headers)
+
+
+async def ndjson_chunks(rows: AsyncIterable[dict]):
+    buffer = bytearray()
+    async for row in rows:
+        buffer += dump_json(row)
+        buffer += b"\n"
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def csv_chunks(rows: AsyncIterable[Iterable], header: Iterable[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    async for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def gzip_chunks(chunks: AsyncIterable[bytes]):
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    async for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "").lower()
+
+
+def streaming_export(chunks: AsyncIterable[bytes], media_type: str, filename: str, gzip=False) -> StreamingResponse:
+    """
+    Download written chunk by chunk, compressed on the fly when the client accepts gzip
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
@@ -0,0 +1,41 @@
+from sqlalchemy import Computed, Text, func, literal
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+# one configuration for the stored vectors and the queries; "simple" does not stem, so it suits mixed-language text
+SEARCH_CONFIG = "simple"
+HEADLINE_OPTIONS = "StartSel=<b>, StopSel=</b>, MaxWords=35, MinWords=15, MaxFragments=2"
+# "&" goes first, so the entities of the others are not escaped again
+HTML_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#39;"))
+
+
+def weighted_tsvector(*weighted_columns: tuple[str, str]) -> Computed:
+    """
+    Stored generated tsvector over (column, weight) pairs
+    """
+    parts = [f"setweight(to_tsvector('{SEARCH_CONFIG}', {column}), '{weight}')" for column, weight in weighted_columns]
+    return Computed(" || ".join(parts), persisted=True)
+
+
+def config():
+    return literal(SEARCH_CONFIG, REGCONFIG)
+
+
+def search_query(text: str):
+    """
+    tsquery parsed from user input with the web search syntax: quoted phrases, "or" and "-word" are understood
+    """
+    return func.websearch_to_tsquery(config(), literal(text, Text))
+
+
+def html_escape(column):
+    for char, entity in HTML_ESCAPES:
+        column = func.replace(column, char, entity)
+    return column
+
+
+def headline(column, query):
+    """
+    HTML fragments of the text around the matches; the text is escaped first, so the only markup in them is the
+    <b></b> around the matched words
+    """
+    return func.ts_headline(config(), html_escape(column), query, HEADLINE_OPTIONS)
@@ -0,0 +1,31 @@
+from sqlalchemy import DateTime, Text, case, func, literal_column
+
+# dump_json writes aware datetimes in UTC with "Z" and leaves zero microseconds out
+ISO_SECONDS = 'YYYY-MM-DD"T"HH24:MI:SS"Z"'
+ISO_MICROSECONDS = 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'
+EMPTY_JSON_ARRAY = literal_column("'[]'::json")
+
+
+def iso_utc(column):
+    """
+    timestamptz as the text dump_json writes for it
+    """
+    template = case((func.date_trunc("second", column) == column, ISO_SECONDS), else_=ISO_MICROSECONDS)
+    return func.to_char(func.timezone("UTC", column), template)
+
+
+def json_fields(source, fields) -> dict:
+    """
+    Columns of the source (a model or the .c of a subquery) by field name, datetimes rendered as dump_json does
+    """
+    columns = {field: getattr(source, field) for field in fields}
+    return {field: iso_utc(column) if isinstance(column.type, DateTime) else column
+            for field, column in columns.items()}
+
+
+def json_object(columns: dict):
+    """
+    json_build_object over the name, column pairs, which keeps their order in the text
+    """
+    return func.json_build_object(*(part for name, column in columns.items()
+                                    for part in (literal_column(f"'{name}'"), column)), type_=Text)